@@ -44,6 +44,10 @@ class Config:
         self.language_filter = os.getenv("LANGUAGE_FILTER", "").split(",")
         self.download_all = os.getenv("DOWNLOAD_ALL", "false").lower() == "true"
         
+        # SQLite memory knobs, per connection page cache and mmap cap
+        self.db_cache_mib = int(os.getenv("DB_CACHE_MIB", "64"))
+        self.db_mmap_mib = int(os.getenv("DB_MMAP_MIB", "1024"))
+        
         # Parse update schedule
         schedule_str = os.getenv("UPDATE_SCHEDULE", "0 2 1 * *")
         minute, hour, day, month, day_of_week = schedule_str.split()
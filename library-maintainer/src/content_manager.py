@@ -6,14 +6,15 @@ Handles downloading, verifying, and managing ZIM files.
 import asyncio
 import os
 import time
-import json
+import orjson
 from datetime import datetime
+from email.utils import formatdate
 import re
 import hashlib
-from typing import Dict, List, Optional, Tuple
+import html
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 import aiohttp
 import aiofiles
-from bs4 import BeautifulSoup
 import structlog
 import traceback
 from dataclasses import dataclass
@@ -21,12 +22,150 @@ from urllib.parse import urljoin
 import aiofiles.os
 import tempfile
 import xml.etree.ElementTree as ET
+from lxml import etree
 
 from config import Config, ContentItem
 import monitoring
 
 log = structlog.get_logger()
 
+# Read size for streaming downloads
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Upper bound on byte ranges fetched in parallel, one per mirror
+DOWNLOAD_SEGMENTS = 4
+
+# Files smaller than this are always fetched over a single connection
+SEGMENTED_DOWNLOAD_MIN_SIZE = 64 * 1024 * 1024
+
+# Size of the page cache window released while writing large downloads
+PAGE_CACHE_WINDOW = 256 * 1024 * 1024
+
+# Meta4 fetch workers used while listing available content
+META4_FETCH_CONCURRENCY = 32
+
+# Capacity of each queue between the stages of the content listing pipeline
+PIPELINE_QUEUE_SIZE = 200
+
+# Bytes of library XML fed to the pull parser at a time
+LIBRARY_PARSE_CHUNK_SIZE = 1024 * 1024
+
+# Temp files renamed or removed per worker-thread call during cleanup
+CLEANUP_BATCH_SIZE = 256
+
+# Evenly spaced windows sampled for a quick identity check of a local file
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_WINDOW = 4 * 1024 * 1024
+
+# Content version as used in ZIM filenames, e.g. 2024-05
+_YYYYMM_RE = re.compile(r'\d{4}-(0[1-9]|1[0-2])$')
+_VERSION_RE = re.compile(r'_(\d{4}-\d{2})\.zim$')
+
+def _drop_page_cache(fd: int, offset: int = 0, length: int = 0):
+    """Advise the kernel that a byte range of a file will not be read again."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        log.debug("page_cache.drop_failed", error=str(e))
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    """Write all of data at offset, continuing after short writes.
+    
+    Raises OSError (e.g. ENOSPC) if the bytes can't all be written, so a
+    caller that advances its offset and hash afterwards only ever counts
+    bytes that are on disk.
+    """
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        if written <= 0:
+            raise OSError(f"pwrite wrote {written} of {len(view)} bytes at {offset}")
+        view = view[written:]
+        offset += written
+
+async def _write_at(fd: int, data: bytes, offset: int):
+    """Write data at offset from a worker thread.
+    
+    A worker thread can't be interrupted, so if the caller is cancelled
+    this still waits for the write to finish before re-raising. That keeps
+    fd open for as long as any write against it is in flight.
+    """
+    write = asyncio.ensure_future(asyncio.to_thread(_pwrite_all, fd, data, offset))
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        while not write.done():
+            try:
+                await asyncio.wait([write])
+            except asyncio.CancelledError:
+                pass
+        if not write.cancelled():
+            # Retrieved so a failed write isn't reported as unhandled
+            write.exception()
+        raise
+
+def _revalidation_headers(response: aiohttp.ClientResponse) -> Dict[str, str]:
+    """Build conditional request headers from a response's validators."""
+    headers = {}
+    if 'ETag' in response.headers:
+        headers['If-None-Match'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers
+
+async def _iter_library_books(path: str) -> AsyncIterator[Dict[str, str]]:
+    """Stream the attributes of every book out of a library XML file.
+    
+    Elements are cleared as soon as they are read, so memory stays flat
+    regardless of catalogue size.
+    """
+    parser = etree.XMLPullParser(events=('end',), tag='book')
+    with open(path, 'rb') as f:
+        # Reading and parsing both happen off the event loop, one chunk's
+        # worth of books at a time
+        while books := await asyncio.to_thread(_parse_library_chunk, parser, f):
+            for book in books:
+                yield book
+    parser.close()
+
+def _parse_library_chunk(parser: etree.XMLPullParser, f) -> List[Dict[str, str]]:
+    """Feed the parser until it yields books or the file runs out.
+    
+    Returns:
+        Attributes of the books completed by this chunk, empty at end of file
+    """
+    books = []
+    while not books and (chunk := f.read(LIBRARY_PARSE_CHUNK_SIZE)):
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            books.append(dict(elem.attrib))
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    return books
+
+def _quick_fingerprint(path: str) -> Optional[str]:
+    """Hash size, mtime and sampled windows of a file as a cheap identity check.
+    
+    This is not an integrity check; it only tells whether a file that was
+    fully verified earlier is still the same file.
+    """
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            fp = hashlib.blake2b(digest_size=16)
+            fp.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+            for i in range(FINGERPRINT_SAMPLES):
+                f.seek(i * st.st_size // FINGERPRINT_SAMPLES)
+                fp.update(f.read(FINGERPRINT_WINDOW))
+            _drop_page_cache(f.fileno())
+        return fp.hexdigest()
+    except OSError as e:
+        log.debug("fingerprint.failed", path=path, error=str(e))
+        return None
+
 @dataclass
 class ContentFile:
     """Represents a content file found on the Kiwix server."""
@@ -48,6 +187,9 @@ class ApacheDirectoryParser:
     def __init__(self):
         self.date_pattern = re.compile(r'\d{4}-\d{2}-\d{2}')
         self.size_pattern = re.compile(r'(\d+\.?\d*[KMGT]?)')
+        self.pre_pattern = re.compile(r'<pre[^>]*>(.*?)</pre>', re.IGNORECASE | re.DOTALL)
+        self.link_pattern = re.compile(r'<a\s[^>]*?href="([^"]*)"', re.IGNORECASE)
+        self.tag_pattern = re.compile(r'<[^>]+>')
         self.cache = {}  # Cache parsed directory listings
         self.cache_ttl = 300  # Cache TTL in seconds
     
@@ -80,34 +222,21 @@ class ApacheDirectoryParser:
         if cached is not None:
             return cached
             
-        soup = BeautifulSoup(content, 'html.parser')
         entries = []
         
         # Find the pre element containing the directory listing
-        pre = soup.find('pre')
+        pre = self.pre_pattern.search(content)
         if not pre:
             return []
-            
-        lines = pre.get_text().split('\n')
-        current_link = None
         
-        for link in pre.find_all('a'):
-            href = link.get('href')
-            if not href or href == "../" or href.startswith("?C="):
+        # Apache emits one entry per line: <a href="...">name</a> date time size
+        for line in pre.group(1).split('\n'):
+            links = self.link_pattern.findall(line)
+            if not links:
                 continue
-                
-            # Find the line containing this link
-            link_line = None
-            for line in lines:
-                if href in line:
-                    link_line = line.strip()
-                    break
-                    
-            if not link_line:
-                continue
-                
-            # Parse date and size
-            parts = link_line.split()
+            
+            # Parse date and size from the line's text
+            parts = html.unescape(self.tag_pattern.sub('', line)).split()
             date_str = None
             size_str = "-"
             
@@ -119,7 +248,13 @@ class ApacheDirectoryParser:
                             size_str = parts[i+2]
                     break
             
-            if date_str:
+            if not date_str:
+                continue
+            
+            for href in links:
+                href = html.unescape(href)
+                if not href or href == "../" or href.startswith("?C="):
+                    continue
                 entries.append((href, date_str, size_str))
         
         # Cache the results
@@ -136,7 +271,14 @@ class ContentManager:
         self.download_semaphore = asyncio.Semaphore(
             config.options.max_concurrent_downloads
         )
+        self._session: Optional[aiohttp.ClientSession] = None
         self.content_state: Dict[str, Dict] = {}
+        self._state_dirty = False
+        # Validators and parsed result of each meta4 file, kept across update
+        # cycles so unchanged files are answered with a 304
+        self._meta4_validators: Dict[str, Tuple[Dict[str, str], Tuple[List[str], Optional[str]]]] = {}
+        self._library_validators: Dict[str, str] = {}
+        self._meta4_inflight: Dict[str, asyncio.Future] = {}
         self.directory_parser = ApacheDirectoryParser()
         self.library_xml_url = "https://download.kiwix.org/library/library_zim.xml"
         self.download_queue = asyncio.Queue()
@@ -144,6 +286,9 @@ class ContentManager:
         self.library_manager = None  # Will be set by main service
         self.web_server = None  # Will be set by main service
         self.db = None  # Will be set by main service
+        self._language_pattern = self._build_language_pattern()
+        # Directories already created, so repeat downloads skip the syscalls
+        self._ensured_dirs: Set[str] = set()
         self._load_state()
         
         # Start download worker
@@ -200,48 +345,120 @@ class ContentManager:
         state_file = os.path.join(self.config.data_dir, "content_state.json")
         if os.path.exists(state_file):
             try:
-                with open(state_file, 'r') as f:
-                    self.content_state = json.loads(f.read())
+                with open(state_file, 'rb') as f:
+                    self.content_state = orjson.loads(f.read())
                 log.info("content_state.loaded", items=len(self.content_state))
             except Exception as e:
                 log.error("content_state.load_failed", error=str(e))
     
+    def _set_state(self, name: str, state: Dict):
+        """Record the state of a content item, marking the state file dirty on change."""
+        if self.content_state.get(name) != state:
+            self.content_state[name] = state
+            self._state_dirty = True
+    
     async def _save_state(self):
-        """Save content state to state file."""
+        """Save content state to state file if it changed."""
+        if not self._state_dirty:
+            return
+            
         state_file = os.path.join(self.config.data_dir, "content_state.json")
+        temp_file = f"{state_file}.tmp"
         try:
-            async with aiofiles.open(state_file, 'w') as f:
-                await f.write(json.dumps(self.content_state, indent=2))
+            async with aiofiles.open(temp_file, 'wb') as f:
+                await f.write(orjson.dumps(self.content_state, option=orjson.OPT_INDENT_2))
+            # Atomically replace the old state file
+            os.replace(temp_file, state_file)
+            self._state_dirty = False
             log.info("content_state.saved", items=len(self.content_state))
         except Exception as e:
             log.error("content_state.save_failed", error=str(e))
     
-    def _matches_language_filter(self, filename: str) -> bool:
-        """Check if filename matches language filter."""
-        if not self.config.language_filter:
-            return True
-            
-        for lang in self.config.language_filter:
+    def _ensure_dir(self, path: str):
+        """Create a directory once per process."""
+        if path not in self._ensured_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._ensured_dirs.add(path)
+
+    def _open_for_write(self, path: str, flags: int) -> int:
+        """Open a file in a directory created by _ensure_dir.
+        
+        A directory removed while the process runs is recreated and the
+        open retried once, instead of failing every later download.
+        """
+        directory = os.path.dirname(path)
+        self._ensure_dir(directory)
+        try:
+            return os.open(path, flags, 0o644)
+        except FileNotFoundError:
+            self._ensured_dirs.discard(directory)
+            self._ensure_dir(directory)
+            return os.open(path, flags, 0o644)
+
+    def _build_language_pattern(self) -> Optional[re.Pattern]:
+        """Compile the language filter into a single alternation pattern."""
+        patterns = []
+        for lang in self.config.language_filter or []:
             if not lang:  # Skip empty language codes
                 continue
                 
             # Match language codes in Kiwix format
             # Example: wikipedia_en_all_maxi_2024-05.zim
-            patterns = [
+            patterns.extend([
                 f"_{lang}_all_",  # Standard Kiwix format
                 f"_{lang}_",      # Simple language code
                 f".{lang}.",      # Language in extension
                 f"_{lang}."       # Language at end
-            ]
-            
-            for pattern in patterns:
-                if pattern in filename:
-                    return True
-                    
-        return False
+            ])
+        
+        if not patterns:
+            return None
+        return re.compile('|'.join(re.escape(p) for p in patterns))
     
-    async def _fetch_library_xml(self) -> Optional[ET.Element]:
-        """Fetch and parse the central library XML file."""
+    def _matches_language_filter(self, filename: str) -> bool:
+        """Check if filename matches language filter."""
+        if not self.config.language_filter:
+            return True
+        
+        if self._language_pattern is None:
+            return False
+        return self._language_pattern.search(filename) is not None
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Get the shared session used for library and meta4 fetches."""
+        if self._session is None or self._session.closed:
+            # Every meta4 worker talks to the same host, so the per-host cap
+            # has to fit all of them or they queue for a pooled connection
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=META4_FETCH_CONCURRENCY,
+                ttl_dns_cache=600,
+                keepalive_timeout=60
+            )
+            # No total timeout: it would also count time spent waiting for a
+            # free connection in the pool
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=60,
+                    sock_read=300
+                )
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _refresh_library_xml(self) -> Optional[str]:
+        """Bring the local copy of the central library XML up to date.
+        
+        Returns:
+            Path to the local copy, or None if there is none
+        """
         try:
             # Check for cached local copy in shared data folder
             local_library_file = os.path.join(self.config.data_dir, "library_zim.xml")
@@ -249,74 +466,122 @@ class ContentManager:
             # Create data directory if it doesn't exist
             os.makedirs(self.config.data_dir, exist_ok=True)
             
+            # Revalidate the local copy rather than downloading it again
+            headers = {}
             if os.path.exists(local_library_file):
-                log.info("library_xml.using_local_cache", path=local_library_file)
-                async with aiofiles.open(local_library_file, 'r') as f:
-                    content = await f.read()
-                return ET.fromstring(content)
+                headers = self._library_validators or {
+                    'If-Modified-Since': formatdate(os.path.getmtime(local_library_file), usegmt=True)
+                }
             
-            # If no local cache, fetch from remote
             log.info("library_xml.fetching", url=self.library_xml_url)
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.library_xml_url) as response:
-                    if response.status != 200:
-                        log.error("library_xml.fetch_failed", status=response.status)
-                        return None
-                    content = await response.text()
-                    
-                    # Cache the XML in shared data folder
-                    try:
-                        async with aiofiles.open(local_library_file, 'w') as f:
-                            await f.write(content)
+            try:
+                session = await self.get_session()
+                async with session.get(self.library_xml_url, headers=headers) as response:
+                    if response.status == 200:
+                        # Stream to disk instead of holding the document in memory
+                        temp_file = f"{local_library_file}.tmp"
+                        async with aiofiles.open(temp_file, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                await f.write(chunk)
+                        os.replace(temp_file, local_library_file)
+                        self._library_validators = _revalidation_headers(response)
                         log.info("library_xml.cached", path=local_library_file)
-                    except Exception as e:
-                        log.error("library_xml.cache_failed", error=str(e), path=local_library_file)
+                        return local_library_file
                     
-                    return ET.fromstring(content)
+                    if response.status == 304:
+                        log.info("library_xml.not_modified")
+                    else:
+                        log.error("library_xml.fetch_failed", status=response.status)
+            except aiohttp.ClientError as e:
+                log.warning("library_xml.revalidate_failed", error=str(e))
+            
+            # Unchanged or unreachable: fall back to the local copy
+            if not os.path.exists(local_library_file):
+                return None
+            log.info("library_xml.using_local_cache", path=local_library_file)
+            return local_library_file
         except Exception as e:
             log.error("library_xml.fetch_failed", error=str(e))
             return None
 
-    async def _fetch_meta4_file(self, url: str) -> Tuple[List[str], Optional[str]]:
+    async def _fetch_library_xml(self) -> Optional[ET.Element]:
+        """Fetch and parse the central library XML file."""
+        library_file = await self._refresh_library_xml()
+        if not library_file:
+            return None
+        try:
+            return await asyncio.to_thread(lambda: ET.parse(library_file).getroot())
+        except Exception as e:
+            log.error("library_xml.parse_failed", error=str(e))
+            return None
+
+    async def _fetch_meta4_file(self, url: str, meta4_cache: Optional[Dict[str, Tuple[List[str], Optional[str]]]] = None) -> Tuple[List[str], Optional[str]]:
         """
         Fetch and parse a meta4 file to get mirror URLs and MD5.
         
+        Args:
+            url: URL of the meta4 file
+            meta4_cache: Parsed meta4 files of the current update cycle, if any
+        
         Returns:
             Tuple of (mirror_urls, md5_hash)
         """
+        if meta4_cache is not None and url in meta4_cache:
+            return meta4_cache[url]
+        
+        # Concurrent callers for the same URL share one request
+        request = self._meta4_inflight.get(url)
+        if request is None:
+            request = asyncio.ensure_future(self._request_meta4_file(url))
+            self._meta4_inflight[url] = request
+            request.add_done_callback(lambda _: self._meta4_inflight.pop(url, None))
+        mirrors, md5_hash = await asyncio.shield(request)
+        if meta4_cache is not None and (mirrors or md5_hash):
+            meta4_cache[url] = (mirrors, md5_hash)
+        return mirrors, md5_hash
+
+    async def _request_meta4_file(self, url: str) -> Tuple[List[str], Optional[str]]:
+        """Request and parse a meta4 file, revalidating a previous copy if any."""
+        headers, previous = self._meta4_validators.get(url, ({}, None))
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        log.error("meta4.fetch_failed", status=response.status)
-                        return [], None
-                    content = await response.text()
-                    root = ET.fromstring(content)
+            session = await self.get_session()
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and previous is not None:
+                    return previous
+                if response.status != 200:
+                    log.error("meta4.fetch_failed", status=response.status)
+                    return [], None
+                content = await response.text()
+                root = ET.fromstring(content)
                     
-                    # Extract mirror URLs from meta4 file
-                    mirrors = []
-                    for url_elem in root.findall(".//{urn:ietf:params:xml:ns:metalink}url"):
-                        mirror_url = url_elem.text
-                        if mirror_url:
-                            mirrors.append(mirror_url)
+                # Extract mirror URLs from meta4 file
+                mirrors = []
+                for url_elem in root.findall(".//{urn:ietf:params:xml:ns:metalink}url"):
+                    mirror_url = url_elem.text
+                    if mirror_url:
+                        mirrors.append(mirror_url)
                     
-                    # Extract MD5 hash
-                    md5_hash = None
-                    hash_elem = root.find(".//{urn:ietf:params:xml:ns:metalink}hash[@type='md5']")
-                    if hash_elem is not None and hash_elem.text:
-                        md5_hash = hash_elem.text
+                # Extract MD5 hash
+                md5_hash = None
+                hash_elem = root.find(".//{urn:ietf:params:xml:ns:metalink}hash[@type='md5']")
+                if hash_elem is not None and hash_elem.text:
+                    md5_hash = hash_elem.text
                     
-                    return mirrors, md5_hash
+                if mirrors or md5_hash:
+                    validators = _revalidation_headers(response)
+                    if validators:
+                        self._meta4_validators[url] = (validators, (mirrors, md5_hash))
+                return mirrors, md5_hash
         except Exception as e:
             log.error("meta4.fetch_failed", error=str(e))
             return [], None
 
-    async def _get_remote_md5(self, url: str) -> Optional[str]:
+    async def _get_remote_md5(self, url: str, meta4_cache: Optional[Dict[str, Tuple[List[str], Optional[str]]]] = None) -> Optional[str]:
         """Get MD5 hash from meta4 file."""
         try:
             if url.endswith('.meta4'):
                 # Extract MD5 from meta4 file
-                mirrors, md5_hash = await self._fetch_meta4_file(url)
+                mirrors, md5_hash = await self._fetch_meta4_file(url, meta4_cache)
                 if md5_hash:
                     return md5_hash
             return None
@@ -324,41 +589,28 @@ class ContentManager:
             log.error("md5_fetch.error", url=url, error=str(e))
             return None
 
-    def _calculate_file_md5(self, filepath: str, chunk_size: int = 1024*1024) -> Optional[str]:
+    def _calculate_file_md5(self, filepath: str) -> Optional[str]:
         """Calculate MD5 hash of a file.
         
+        The hashing loop runs in C via hashlib.file_digest and releases the
+        GIL, so callers should run this in a worker thread.
+        
         Args:
             filepath: Path to file to hash
-            chunk_size: Size of chunks to read (default 1MB)
             
         Returns:
             MD5 hash as hex string, or None on error
         """
         try:
             log.info("md5_calculate.starting", filepath=filepath)
-            md5_hash = hashlib.md5()
-            file_size = os.path.getsize(filepath)
-            processed = 0
-            
             with open(filepath, "rb") as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    md5_hash.update(chunk)
-                    processed += len(chunk)
-                    
-                    # Log progress every 5%
-                    if file_size > 0:
-                        progress = (processed / file_size) * 100
-                        if progress % 5 < (chunk_size / file_size) * 100:
-                            log.info("md5_calculate.progress", 
-                                   filepath=filepath,
-                                   progress=f"{progress:.1f}%",
-                                   processed=processed,
-                                   total=file_size)
+                file_size = os.fstat(f.fileno()).st_size
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                result = hashlib.file_digest(f, 'md5').hexdigest()
+                # The file is read once; don't let it evict hotter pages
+                _drop_page_cache(f.fileno())
                             
-            result = md5_hash.hexdigest()
             log.info("md5_calculate.complete", 
                     filepath=filepath, 
                     md5=result,
@@ -371,19 +623,18 @@ class ContentManager:
     def _compare_versions(self, current_version: str, new_version: str) -> bool:
         """Compare version strings to determine if new version is newer.
         Returns True if new_version is newer than current_version."""
-        try:
-            current_date = datetime.strptime(current_version, "%Y-%m")
-            new_date = datetime.strptime(new_version, "%Y-%m")
-            return new_date > current_date
-        except ValueError:
+        # "YYYY-MM" strings sort lexicographically in date order
+        if not (_YYYYMM_RE.match(current_version or '') and
+                _YYYYMM_RE.match(new_version or '')):
             log.error("version_compare.error", 
                      current=current_version, 
                      new=new_version)
             return False
+        return new_version > current_version
 
     def _extract_version_from_filename(self, filename: str) -> Optional[str]:
         """Extract version (YYYY-MM) from filename."""
-        match = re.search(r'_(\d{4}-\d{2})\.zim$', filename)
+        match = _VERSION_RE.search(filename)
         return match.group(1) if match else None
 
     async def _verify_download(self, filepath: str, md5_url: str) -> bool:
@@ -392,7 +643,7 @@ class ContentManager:
         if not expected_md5:
             return False
             
-        actual_md5 = self._calculate_file_md5(filepath)
+        actual_md5 = await asyncio.to_thread(self._calculate_file_md5, filepath)
         if not actual_md5:
             return False
             
@@ -404,9 +655,151 @@ class ContentManager:
                      actual=actual_md5)
         return matches
 
-    async def _download_file(self, url: str, dest_path: str, content: ContentItem, mirrors: List[str] = None, expected_md5: str = None) -> bool:
+    async def _finish_download(self, temp_path: str, dest_path: str, actual_md5: str,
+                               expected_md5: Optional[str], existing_files: List[str],
+                               content: ContentItem, download_url: str) -> bool:
+        """Verify a completed download and move it into place.
+        
+        Returns:
+            True if the file was installed, False if its MD5 did not match
+        """
+        if expected_md5:
+            if actual_md5.lower() != expected_md5.lower():
+                log.error("md5_verify.mismatch",
+                        file=temp_path,
+                        expected=expected_md5,
+                        actual=actual_md5,
+                        content=content.name,
+                        url=download_url)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return False
+            
+            log.info("md5_verify.success",
+                    content=content.name,
+                    md5=actual_md5,
+                    expected=expected_md5,
+                    file=temp_path)
+        
+        # Move file to final location
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        os.rename(temp_path, dest_path)
+        
+        # Remove old versions after successful download
+        for old_file in existing_files:
+            if old_file != dest_path:
+                try:
+                    os.remove(old_file)
+                    log.info("old_version.removed", file=old_file)
+                except Exception as e:
+                    log.error("old_version.remove_failed",
+                            file=old_file,
+                            error=str(e))
+        
+        log.info("download.complete",
+                content=content.name,
+                size=os.path.getsize(dest_path))
+                
+        monitoring.record_download("success", content.language)
+        return True
+
+    def _hash_partial_file(self, filepath: str) -> Tuple[Any, int]:
+        """Hash the bytes already present in a partial download.
+        
+        Returns:
+            Tuple of (md5 hash object ready to continue, bytes hashed)
+        """
+        with open(filepath, 'rb') as f:
+            md5_hash = hashlib.file_digest(f, 'md5')
+            size = os.fstat(f.fileno()).st_size
+            _drop_page_cache(f.fileno())
+        return md5_hash, size
+
+    async def _download_segmented(self, session: aiohttp.ClientSession, urls: List[str],
+                                  temp_path: str, content: ContentItem) -> bool:
+        """Download a file as parallel byte ranges spread across mirrors.
+        
+        Returns:
+            True if the file was downloaded, False if the server does not
+            support ranged requests or the file is too small to split
+        """
+        async with session.head(urls[0], allow_redirects=True) as response:
+            total_size = int(response.headers.get('content-length', 0))
+            accepts_ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+        
+        if not accepts_ranges or total_size < SEGMENTED_DOWNLOAD_MIN_SIZE:
+            return False
+        
+        # One range per mirror so each connection pulls from a different host
+        segments = min(len(urls), DOWNLOAD_SEGMENTS)
+        segment_size = -(-total_size // segments)
+        ranges = [
+            (start, min(start + segment_size, total_size) - 1)
+            for start in range(0, total_size, segment_size)
+        ]
+        
+        # Preallocate the whole file so segments can be written in place
+        # through a single shared descriptor
+        fd = self._open_for_write(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        
+        log.info("download.segmented_starting",
+                content=content.name,
+                size=total_size,
+                segments=len(ranges),
+                mirrors=len(urls))
+        
+        downloaded = 0
+        
+        async def fetch_range(mirror_url: str, start: int, end: int):
+            nonlocal downloaded
+            headers = {'Range': f'bytes={start}-{end}'}
+            async with session.get(mirror_url, headers=headers) as response:
+                if response.status != 206:
+                    raise Exception(f"Range request not honoured: {response.status}")
+                
+                offset = start
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await _write_at(fd, chunk, offset)
+                    offset += len(chunk)
+                    downloaded += len(chunk)
+                    monitoring.update_content_size(
+                        content.name,
+                        content.language,
+                        downloaded
+                    )
+                
+                written = offset - start
+                if written != end - start + 1:
+                    raise Exception(f"Short range read: {written} of {end - start + 1} bytes")
+        
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+            
+            async with asyncio.TaskGroup() as tg:
+                for url, (start, end) in zip(urls, ranges):
+                    tg.create_task(fetch_range(url, start, end))
+        except BaseException:
+            # The task group has waited for every range, and _write_at for
+            # every in-flight write, so nothing still holds fd.
+            # A preallocated file with holes can't be resumed from its size
+            os.close(fd)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        _drop_page_cache(fd)
+        os.close(fd)
+        return True
+
+    async def _download_file(self, url: str, dest_path: str, content: ContentItem, mirrors: List[str] = None, expected_md5: str = None, meta4_cache: Optional[Dict[str, Tuple[List[str], Optional[str]]]] = None) -> bool:
         """Download a file with MD5 verification and version management."""
         temp_path = f"{dest_path}.tmp"
+        # Segmented downloads are preallocated with holes and can't be
+        # resumed from their size, so they never share the resumable path
+        segmented_path = f"{dest_path}.segmented.tmp"
         max_retries = self.config.options.retry_attempts
         retry_count = 0
         
@@ -414,7 +807,7 @@ class ContentManager:
         expected_md5 = None
         meta4_mirrors = []
         if url.endswith('.meta4'):
-            meta4_mirrors, meta4_md5 = await self._fetch_meta4_file(url)
+            meta4_mirrors, meta4_md5 = await self._fetch_meta4_file(url, meta4_cache)
             if meta4_md5:
                 log.info("md5_verify.meta4_hash_found", 
                       content=content.name,
@@ -435,62 +828,139 @@ class ContentManager:
         
         try:
             async with self.download_semaphore:
-                while retry_count <= max_retries:
-                    # Try each mirror URL in sequence
-                    urls_to_try = []
-                    if meta4_mirrors:
-                        urls_to_try.extend(meta4_mirrors)
-                    elif mirrors:
-                        urls_to_try.extend(mirrors)
-                    else:
-                        urls_to_try.append(url)
+                timeout = aiohttp.ClientTimeout(
+                    total=None,
+                    connect=120,
+                    sock_read=600,
+                    sock_connect=60
+                )
+                
+                # Keep connections alive so retries and mirror fallbacks reuse them
+                connector = aiohttp.TCPConnector(
+                    force_close=False,
+                    enable_cleanup_closed=True,
+                    limit=4,
+                    limit_per_host=4
+                )
+                
+                async with aiohttp.ClientSession(
+                    timeout=timeout,
+                    connector=connector,
+                    raise_for_status=True
+                ) as session:
+                    # Spread large downloads across mirrors when there are several
+                    segment_urls = [
+                        u[:-6] if u.endswith('.meta4') else u
+                        for u in (meta4_mirrors or mirrors or [])
+                    ]
+                    segment_urls = [
+                        u if u.startswith('http') else urljoin(self.base_url, u)
+                        for u in segment_urls
+                    ]
+                    # Bytes already on disk and hashed; carried across retries
+                    # and mirrors so a dropped connection resumes instead of
+                    # starting the file (and its hash) over
+                    md5_hash = hashlib.md5()
+                    downloaded = 0
+                    
+                    # Pick up a download interrupted by a previous run: a
+                    # .partial kept by cleanup(), or a .tmp left behind when
+                    # the process died before cleanup() could run
+                    partial_path = f"{dest_path}.partial"
+                    if os.path.exists(partial_path):
+                        os.replace(partial_path, temp_path)
+                    if os.path.exists(temp_path):
+                        md5_hash, downloaded = await asyncio.to_thread(
+                            self._hash_partial_file, temp_path)
+                        log.info("download.partial_found",
+                                content=content.name,
+                                size=downloaded)
+                    if os.path.exists(segmented_path):
+                        os.remove(segmented_path)
                     
-                    for current_url in urls_to_try:
+                    if len(segment_urls) > 1 and not downloaded:
                         try:
-                            # Remove any .meta4 extension from mirror URLs
-                            if current_url.endswith('.meta4'):
-                                current_url = current_url[:-6]
-                            
-                            download_url = current_url if current_url.startswith('http') else urljoin(self.base_url, current_url)
-                            log.info("download.starting", 
-                                    content=content.name,
-                                    url=download_url,
-                                    dest=dest_path,
-                                    attempt=retry_count + 1,
-                                    max_attempts=max_retries + 1,
-                                    expected_md5=expected_md5)  # Log the expected MD5
-                            
-                            timeout = aiohttp.ClientTimeout(
-                                total=None,
-                                connect=120,
-                                sock_read=600,
-                                sock_connect=60
-                            )
+                            if await self._download_segmented(session, segment_urls, segmented_path, content):
+                                actual_md5 = await asyncio.to_thread(self._calculate_file_md5, segmented_path)
+                                if actual_md5 and await self._finish_download(
+                                        segmented_path, dest_path, actual_md5, expected_md5,
+                                        existing_files, content, segment_urls[0]):
+                                    return True
+                        except Exception as e:
+                            log.warning("download.segmented_failed",
+                                      content=content.name,
+                                      error=str(e))
+                    
+                    while retry_count <= max_retries:
+                        # Try each mirror URL in sequence
+                        urls_to_try = []
+                        if meta4_mirrors:
+                            urls_to_try.extend(meta4_mirrors)
+                        elif mirrors:
+                            urls_to_try.extend(mirrors)
+                        else:
+                            urls_to_try.append(url)
+                    
+                        for current_url in urls_to_try:
+                            try:
+                                # Remove any .meta4 extension from mirror URLs
+                                if current_url.endswith('.meta4'):
+                                    current_url = current_url[:-6]
                             
-                            connector = aiohttp.TCPConnector(
-                                force_close=True,
-                                enable_cleanup_closed=True,
-                                limit=1
-                            )
+                                download_url = current_url if current_url.startswith('http') else urljoin(self.base_url, current_url)
+                                log.info("download.starting", 
+                                        content=content.name,
+                                        url=download_url,
+                                        dest=dest_path,
+                                        attempt=retry_count + 1,
+                                        max_attempts=max_retries + 1,
+                                        expected_md5=expected_md5)  # Log the expected MD5
                             
-                            async with aiohttp.ClientSession(
-                                timeout=timeout,
-                                connector=connector,
-                                raise_for_status=True
-                            ) as session:
-                                async with session.get(download_url) as response:
-                                    if response.status != 200:
+                                headers = {}
+                                if downloaded and os.path.exists(temp_path):
+                                    headers['Range'] = f'bytes={downloaded}-'
+                                    log.info("download.resuming",
+                                            content=content.name,
+                                            offset=downloaded)
+                                
+                                async with session.get(download_url, headers=headers) as response:
+                                    if response.status == 206 and headers:
+                                        resume_from = downloaded
+                                    elif response.status == 200:
+                                        # Server ignored the range; start over
+                                        resume_from = 0
+                                        md5_hash = hashlib.md5()
+                                    else:
                                         raise Exception(f"Download failed: {response.status}")
                                     
                                     total_size = int(response.headers.get('content-length', 0))
-                                    downloaded = 0
-                                    
-                                    os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+                                    if total_size > 0:
+                                        total_size += resume_from
+                                    downloaded = resume_from
                                     
-                                    async with aiofiles.open(temp_path, 'wb') as f:
-                                        async for chunk in response.content.iter_chunked(1024 * 1024):
-                                            await f.write(chunk)
+                                    # Write in place with pwrite into a preallocated file,
+                                    # hash while writing so the file is never re-read,
+                                    # and drop written pages from the page cache
+                                    flags = os.O_WRONLY | os.O_CREAT | (0 if resume_from else os.O_TRUNC)
+                                    fd = self._open_for_write(temp_path, flags)
+                                    try:
+                                        # Discard anything past the last hashed byte
+                                        os.ftruncate(fd, resume_from)
+                                        if total_size > resume_from and hasattr(os, 'posix_fallocate'):
+                                            os.posix_fallocate(fd, resume_from, total_size - resume_from)
+                                        
+                                        dropped = resume_from - resume_from % PAGE_CACHE_WINDOW
+                                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                            await _write_at(fd, chunk, downloaded)
+                                            md5_hash.update(chunk)
                                             downloaded += len(chunk)
+
+                                            # Lag one window behind so the kernel has
+                                            # had a chance to write the pages back
+                                            if downloaded - dropped >= 2 * PAGE_CACHE_WINDOW:
+                                                _drop_page_cache(fd, dropped, PAGE_CACHE_WINDOW)
+                                                dropped += PAGE_CACHE_WINDOW
+
                                             monitoring.update_content_size(
                                                 content.name,
                                                 content.language,
@@ -504,85 +974,58 @@ class ContentManager:
                                                         progress=f"{progress:.1f}%",
                                                         downloaded=downloaded,
                                                         total=total_size)
-                                    
+                                    finally:
+                                        # Trim the preallocation so the file size always
+                                        # matches the hashed bytes and can be resumed
+                                        os.ftruncate(fd, downloaded)
+                                        _drop_page_cache(fd)
+                                        os.close(fd)
+
                                     # Always verify MD5 if provided
-                                    actual_md5 = self._calculate_file_md5(temp_path)
-                                    if not actual_md5:
-                                        log.error("md5_calculate.failed", 
-                                                file=temp_path,
-                                                content=content.name)
-                                        continue
-                                    
-                                    if expected_md5:
-                                        if actual_md5.lower() != expected_md5.lower():
-                                            log.error("md5_verify.mismatch",
-                                                    file=temp_path,
-                                                    expected=expected_md5,
-                                                    actual=actual_md5,
-                                                    content=content.name,
-                                                    url=download_url)
-                                            if os.path.exists(temp_path):
-                                                os.remove(temp_path)
-                                            continue
-                                        
-                                        log.info("md5_verify.success",
-                                                content=content.name,
-                                                md5=actual_md5,
-                                                expected=expected_md5,
-                                                file=temp_path)
-                                    
-                                    # Move file to final location
-                                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                                    os.rename(temp_path, dest_path)
-                                    
-                                    # Remove old versions after successful download
-                                    for old_file in existing_files:
-                                        if old_file != dest_path:
-                                            try:
-                                                os.remove(old_file)
-                                                log.info("old_version.removed", file=old_file)
-                                            except Exception as e:
-                                                log.error("old_version.remove_failed",
-                                                        file=old_file,
-                                                        error=str(e))
-                                    
-                                    log.info("download.complete",
-                                            content=content.name,
-                                            size=os.path.getsize(dest_path))
-                                            
-                                    monitoring.record_download("success", content.language)
-                                    return True
+                                    actual_md5 = md5_hash.hexdigest()
+                                    if await self._finish_download(temp_path, dest_path, actual_md5,
+                                                                   expected_md5, existing_files,
+                                                                   content, download_url):
+                                        return True
+                                    # Mismatched file was removed; the next attempt starts fresh
+                                    md5_hash = hashlib.md5()
+                                    downloaded = 0
+                                    continue
                                     
-                        except Exception as e:
-                            log.error("download.mirror_failed",
-                                    content=content.name,
-                                    url=current_url,
-                                    error=str(e))
-                            continue  # Try next mirror
+                            except Exception as e:
+                                log.error("download.mirror_failed",
+                                        content=content.name,
+                                        url=current_url,
+                                        error=str(e))
+                                if isinstance(e, aiohttp.ClientResponseError) and e.status == 416:
+                                    # Partial file doesn't fit the remote one; start over
+                                    md5_hash = hashlib.md5()
+                                    downloaded = 0
+                                continue  # Try next mirror
                     
-                    # If we get here, all mirrors failed
-                    retry_count += 1
-                    if retry_count <= max_retries:
-                        log.warning("download.retry",
-                                  content=content.name,
-                                  attempt=retry_count,
-                                  max_attempts=max_retries + 1)
-                        await asyncio.sleep(2 ** retry_count)
-                        continue
+                        # If we get here, all mirrors failed
+                        retry_count += 1
+                        if retry_count <= max_retries:
+                            log.warning("download.retry",
+                                      content=content.name,
+                                      attempt=retry_count,
+                                      max_attempts=max_retries + 1)
+                            await asyncio.sleep(2 ** retry_count)
+                            continue
                     
-                    log.error("download.all_mirrors_failed",
-                             content=content.name,
-                             attempts=retry_count)
-                    monitoring.record_download("failed", content.language)
+                        log.error("download.all_mirrors_failed",
+                                 content=content.name,
+                                 attempts=retry_count)
+                        monitoring.record_download("failed", content.language)
                     
-                    if os.path.exists(temp_path):
-                        try:
-                            os.remove(temp_path)
-                        except Exception as cleanup_error:
-                            log.error("download.cleanup_failed",
-                                    content=content.name,
-                                    error=str(cleanup_error))
-                    return False
+                        if os.path.exists(temp_path):
+                            try:
+                                os.remove(temp_path)
+                            except Exception as cleanup_error:
+                                log.error("download.cleanup_failed",
+                                        content=content.name,
+                                        error=str(cleanup_error))
+                        return False
                     
         except Exception as e:
             log.error("download.failed",
@@ -601,16 +1044,33 @@ class ContentManager:
         start_time = time.time()
         log.info("content_update.starting", force_update=force_update)
         
+        # Meta4 files parsed while listing content are reused by the checks and
+        # downloads below, but never outlive this call
+        meta4_cache: Dict[str, Tuple[List[str], Optional[str]]] = {}
+        
         try:
-            available_content = await self._get_available_content()
+            available_content = await self._get_available_content(meta4_cache)
             download_tasks = []
+            checks = []
             
             log.info("content_update.download_list", 
                      content_items=[(item.name, item.language, item.category) 
                                   for item in self.config.content_list])
             
+            # Index the latest version of each content base name in one pass
+            latest_by_base: Dict[str, ContentFile] = {}
+            for content_file in available_content:
+                filename = os.path.basename(content_file.path)
+                match = _VERSION_RE.search(filename)
+                if not match:
+                    continue
+                base_name = filename[:match.start()]
+                current = latest_by_base.get(base_name)
+                if not current or not current.date or content_file.date > current.date:
+                    latest_by_base[base_name] = content_file
+            
             for content_item in self.config.content_list:
-                log.info("content_update.checking_item", 
+                log.debug("content_update.checking_item", 
                          content_name=content_item.name,
                          content_language=content_item.language,
                          content_category=content_item.category)
@@ -618,16 +1078,12 @@ class ContentManager:
                 latest_version = None
                 latest_date = None
                 
-                # Pattern for matching content files
-                pattern = f"{content_item.name}.*_\\d{{4}}-\\d{{2}}.zim$"
-                log.debug("content_update.pattern", pattern=pattern)
-                
-                for content_file in available_content:
-                    filename = os.path.basename(content_file.path)
-                    if re.search(pattern, filename):
-                        log.info("content_update.found_match",
+                # Names match any flavour, e.g. wikipedia_en_all -> wikipedia_en_all_maxi
+                for base_name, content_file in latest_by_base.items():
+                    if content_item.name in base_name:
+                        log.debug("content_update.found_match",
                                 content_name=content_item.name,
-                                filename=filename,
+                                filename=os.path.basename(content_file.path),
                                 date=content_file.date,
                                 size=content_file.size)
                         
@@ -641,7 +1097,7 @@ class ContentManager:
                     
                     # Create category subdirectory
                     category_dir = os.path.join(self.config.data_dir, content_item.category)
-                    os.makedirs(category_dir, exist_ok=True)
+                    self._ensure_dir(category_dir)
                     
                     dest_path = os.path.join(
                         category_dir,
@@ -649,8 +1105,8 @@ class ContentManager:
                     )
                     
                     # Get MD5 before proceeding with download decision
-                    remote_md5_url = f"{latest_version.url}.md5"
-                    remote_md5 = await self._get_remote_md5(remote_md5_url)
+                    remote_md5_url = latest_version.md5_url
+                    remote_md5 = await self._get_remote_md5(remote_md5_url, meta4_cache)
                     
                     if not remote_md5:
                         log.error("md5_fetch.failed_pre_download",
@@ -658,7 +1114,7 @@ class ContentManager:
                                 url=remote_md5_url)
                         continue
                         
-                    log.info("md5_fetch.success_pre_download",
+                    log.debug("md5_fetch.success_pre_download",
                             content=content_item.name,
                             md5=remote_md5,
                             url=remote_md5_url)
@@ -671,8 +1127,15 @@ class ContentManager:
                         'md5': remote_md5
                     }
                     
+                    # Carry over the fingerprint of a file already verified
+                    # against this MD5
+                    previous = self.content_state.get(content_item.name, {})
+                    if (previous.get('fingerprint') and previous.get('md5') == remote_md5
+                            and previous.get('path') == dest_path):
+                        state['fingerprint'] = previous['fingerprint']
+                    
                     # Update state immediately
-                    self.content_state[content_item.name] = state
+                    self._set_state(content_item.name, state)
                     
                     # Check if we already have a version of this file
                     dest_dir = os.path.dirname(dest_path)
@@ -691,58 +1154,106 @@ class ContentManager:
                     size_mismatch = current_size != latest_version.size
                     
                     # Extract date from filename for comparison
-                    date_match = re.search(r'_(\d{4}-\d{2}).zim$', os.path.basename(dest_path)) if os.path.exists(dest_path) else None
+                    date_match = _VERSION_RE.search(os.path.basename(dest_path)) if os.path.exists(dest_path) else None
                     file_date = date_match.group(1) if date_match else None
-                    latest_date = re.search(r'_(\d{4}-\d{2}).zim$', latest_version.path).group(1)
+                    latest_date = _VERSION_RE.search(latest_version.path).group(1)
                     date_mismatch = file_date != latest_date if file_date else True
                     
-                    # Verify MD5 of existing file if it exists
-                    md5_mismatch = False
-                    if os.path.exists(dest_path):
-                        local_md5 = self._calculate_file_md5(dest_path)
-                        if local_md5:
-                            if local_md5 != remote_md5:
-                                log.warning("md5_verify.mismatch_pre_download",
-                                          file=dest_path,
-                                          local_md5=local_md5,
-                                          remote_md5=remote_md5)
-                                md5_mismatch = True
-                            else:
-                                log.info("md5_verify.match_pre_download",
-                                        file=dest_path,
-                                        md5=local_md5)
-                    
-                    needs_update = size_mismatch or date_mismatch or md5_mismatch
-                    
-                    log.info("content_update.download_check",
-                            content_name=content_item.name,
-                            needs_download=needs_download,
-                            needs_update=needs_update,
-                            current_size=current_size,
-                            new_size=latest_version.size,
-                            size_mismatch=size_mismatch,
-                            current_date=file_date,
-                            new_date=latest_date,
-                            date_mismatch=date_mismatch,
-                            md5_mismatch=md5_mismatch)
-                    
-                    if needs_download or needs_update:
-                        log.info("content_update.queueing_download",
-                                content_name=content_item.name,
-                                filename=filename,
-                                size=latest_version.size,
-                                md5=remote_md5)
-                        download_task = self._download_file(
-                            latest_version.url,
-                            dest_path,
-                            content_item,
-                            latest_version.mirrors
-                        )
-                        download_tasks.append(download_task)
+                    checks.append({
+                        'content_item': content_item,
+                        'latest_version': latest_version,
+                        'filename': filename,
+                        'dest_path': dest_path,
+                        'remote_md5': remote_md5,
+                        'needs_download': needs_download,
+                        'current_size': current_size,
+                        'size_mismatch': size_mismatch,
+                        'file_date': file_date,
+                        'latest_date': latest_date,
+                        'date_mismatch': date_mismatch
+                    })
                 else:
                     log.warning("content_update.no_match_found",
-                              content_name=content_item.name,
-                              pattern=pattern)
+                              content_name=content_item.name)
+            
+            # Verify existing files off the event loop. A file whose quick
+            # fingerprint matches the one recorded after its last full MD5
+            # check is trusted; anything else is hashed in full.
+            verify = [c for c in checks if os.path.exists(c['dest_path'])]
+            fingerprints = await asyncio.gather(*[
+                asyncio.to_thread(_quick_fingerprint, c['dest_path'])
+                for c in verify
+            ])
+            full_verify = []
+            for check, fingerprint in zip(verify, fingerprints):
+                check['fingerprint'] = fingerprint
+                recorded = self.content_state.get(check['content_item'].name, {})
+                if fingerprint and recorded.get('fingerprint') == fingerprint:
+                    check['local_md5'] = check['remote_md5']
+                else:
+                    full_verify.append(check)
+            
+            local_md5s = await asyncio.gather(*[
+                asyncio.to_thread(self._calculate_file_md5, c['dest_path'])
+                for c in full_verify
+            ])
+            for check, local_md5 in zip(full_verify, local_md5s):
+                check['local_md5'] = local_md5
+                if local_md5 == check['remote_md5'] and check['fingerprint']:
+                    name = check['content_item'].name
+                    self._set_state(name, {**self.content_state.get(name, {}),
+                                           'fingerprint': check['fingerprint']})
+
+            for check in checks:
+                content_item = check['content_item']
+                latest_version = check['latest_version']
+                remote_md5 = check['remote_md5']
+                
+                md5_mismatch = False
+                local_md5 = check.get('local_md5')
+                if local_md5:
+                    if local_md5 != remote_md5:
+                        log.warning("md5_verify.mismatch_pre_download",
+                                  file=check['dest_path'],
+                                  local_md5=local_md5,
+                                  remote_md5=remote_md5)
+                        md5_mismatch = True
+                    else:
+                        log.debug("md5_verify.match_pre_download",
+                                file=check['dest_path'],
+                                md5=local_md5)
+                
+                needs_download = check['needs_download']
+                needs_update = check['size_mismatch'] or check['date_mismatch'] or md5_mismatch
+                
+                # Only items that need work are interesting at INFO
+                log_check = log.info if needs_download or needs_update else log.debug
+                log_check("content_update.download_check",
+                        content_name=content_item.name,
+                        needs_download=needs_download,
+                        needs_update=needs_update,
+                        current_size=check['current_size'],
+                        new_size=latest_version.size,
+                        size_mismatch=check['size_mismatch'],
+                        current_date=check['file_date'],
+                        new_date=check['latest_date'],
+                        date_mismatch=check['date_mismatch'],
+                        md5_mismatch=md5_mismatch)
+                
+                if needs_download or needs_update:
+                    log.info("content_update.queueing_download",
+                            content_name=content_item.name,
+                            filename=check['filename'],
+                            size=latest_version.size,
+                            md5=remote_md5)
+                    download_task = self._download_file(
+                        latest_version.url,
+                        check['dest_path'],
+                        content_item,
+                        latest_version.mirrors,
+                        meta4_cache=meta4_cache
+                    )
+                    download_tasks.append(download_task)
             
             if download_tasks:
                 log.info("content_update.starting_downloads", count=len(download_tasks))
@@ -767,31 +1278,69 @@ class ContentManager:
             monitoring.set_update_duration(0)
     
     async def cleanup(self):
-        """Clean up temporary files and incomplete downloads."""
+        """Clean up temporary files and keep incomplete downloads for resuming."""
+        # The database belongs to whoever passed it in; it is closed there
+        await self.close()
+        
         if not self.config.options.cleanup_incomplete:
             return
             
         try:
-            for filename in os.listdir(self.config.data_dir):
-                if filename.endswith('.tmp'):
-                    os.remove(os.path.join(self.config.data_dir, filename))
+            temp_files = await asyncio.to_thread(self._scan_temp_files)
+            
+            # Work through the files in batches, yielding to the loop between them
+            for i in range(0, len(temp_files), CLEANUP_BATCH_SIZE):
+                await asyncio.to_thread(self._cleanup_temp_files,
+                                        temp_files[i:i + CLEANUP_BATCH_SIZE])
         except Exception as e:
             log.error("cleanup.failed", error=str(e))
 
+    def _scan_temp_files(self) -> List[str]:
+        """List temp files in the data folder and its category folders."""
+        temp_files = []
+        subdirs = []
+        with os.scandir(self.config.data_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.tmp'):
+                    temp_files.append(entry.path)
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+        
+        # Temp files live next to their destination in category folders
+        for subdir in subdirs:
+            with os.scandir(subdir) as entries:
+                temp_files.extend(e.path for e in entries if e.name.endswith('.tmp'))
+        return temp_files
+
+    def _cleanup_temp_files(self, temp_files: List[str]):
+        """Keep interrupted downloads as .partial files and remove other temp files."""
+        for temp_path in temp_files:
+            try:
+                if temp_path.endswith('.zim.tmp'):
+                    # The next download of this file resumes from here
+                    partial_path = temp_path[:-len('.tmp')] + '.partial'
+                    os.replace(temp_path, partial_path)
+                    log.info("cleanup.partial_kept", path=partial_path)
+                else:
+                    os.remove(temp_path)
+            except OSError as e:
+                log.error("cleanup.file_failed", path=temp_path, error=str(e))
+
     async def _handle_successful_download(self, book: Dict, dest_path: str):
         """Handle post-download tasks after a successful download."""
         try:
             # Update content state
-            self.content_state[book['name']] = {
+            self._set_state(book['name'], {
                 'last_updated': datetime.now().isoformat(),
                 'path': dest_path,
                 'size': os.path.getsize(dest_path)
-            }
+            })
             await self._save_state()
             
             # Update database with download status
             if self.library_manager and self.library_manager.db:
-                self.library_manager.db.update_download_status(
+                await asyncio.to_thread(
+                    self.library_manager.db.update_download_status,
                     book_id=book['name'],
                     status='downloaded',
                     local_path=dest_path
@@ -826,7 +1375,7 @@ class ContentManager:
             )
             
             # Get book info from database
-            book_info = self.db.get_book_info(book['id'])
+            book_info = await asyncio.to_thread(self.db.get_book_info, book['id'])
             if not book_info or 'meta4_info' not in book_info:
                 log.error("queue_download.no_meta4_info", book=book['name'])
                 return
@@ -842,7 +1391,7 @@ class ContentManager:
             
             # Create category subdirectory
             category_dir = os.path.join(self.config.data_dir, content_item.category)
-            os.makedirs(category_dir, exist_ok=True)
+            self._ensure_dir(category_dir)
             
             # Determine destination path
             filename = os.path.basename(url)
@@ -855,7 +1404,8 @@ class ContentManager:
             self.active_downloads.add(book['name'])
             
             # Update database status
-            self.db.update_download_status(book['id'], 'downloading', dest_path)
+            await asyncio.to_thread(self.db.update_download_status,
+                                    book['id'], 'downloading', dest_path)
             
             # Queue the download
             self.download_queue.put_nowait((book, content_item))
@@ -873,7 +1423,7 @@ class ContentManager:
                 
                 try:
                     # Get book info from database
-                    book_info = self.db.get_book_info(book['id'])
+                    book_info = await asyncio.to_thread(self.db.get_book_info, book['id'])
                     if not book_info or 'meta4_info' not in book_info:
                         log.error("download_worker.no_meta4_info", book=book['name'])
                         continue
@@ -890,7 +1440,7 @@ class ContentManager:
                     
                     # Create category subdirectory
                     category_dir = os.path.join(self.config.data_dir, content_item.category)
-                    os.makedirs(category_dir, exist_ok=True)
+                    self._ensure_dir(category_dir)
                     
                     # Determine destination path
                     filename = os.path.basename(url)
@@ -911,11 +1461,13 @@ class ContentManager:
                         
                         if success:
                             # Update database status
-                            self.db.update_download_status(book['id'], 'downloaded', dest_path)
+                            await asyncio.to_thread(self.db.update_download_status,
+                                                    book['id'], 'downloaded', dest_path)
                             log.info("download_worker.success", book=book['name'])
                         else:
                             # Update database status
-                            self.db.update_download_status(book['id'], 'failed', None)
+                            await asyncio.to_thread(self.db.update_download_status,
+                                                    book['id'], 'failed')
                             log.error("download_worker.failed", book=book['name'])
                             
                     finally:
@@ -926,7 +1478,8 @@ class ContentManager:
                     log.error("download_worker.failed", error=str(e))
                     if 'book' in locals():
                         self.active_downloads.discard(book.get('name', ''))
-                        self.db.update_download_status(book['id'], 'failed', None)
+                        await asyncio.to_thread(self.db.update_download_status,
+                                                book['id'], 'failed')
                 
                 finally:
                     # Mark task as done
@@ -952,59 +1505,87 @@ class ContentManager:
             for name in self.active_downloads
         ] 
 
-    async def _get_available_content(self) -> List[ContentFile]:
-        """Get list of available content from central library XML."""
+    async def _fetch_book_meta4(self, book: Dict[str, str], meta4_cache: Optional[Dict[str, Tuple[List[str], Optional[str]]]] = None) -> Tuple[Dict[str, str], List[str], Optional[str]]:
+        """Fetch a book's meta4 file, logging rather than raising on failure."""
+        try:
+            mirrors, md5_hash = await self._fetch_meta4_file(book.get("url", ""), meta4_cache)
+        except Exception as e:
+            log.error("meta4_parse.failed",
+                    name=book.get("name", ""),
+                    error=str(e))
+            return book, [], None
+        return book, mirrors, md5_hash
+
+    async def _get_available_content(self, meta4_cache: Optional[Dict[str, Tuple[List[str], Optional[str]]]] = None) -> List[ContentFile]:
+        """Get list of available content from central library XML.
+        
+        Parsing, meta4 fetching and collecting results run as a pipeline
+        joined by bounded queues, so fetches start with the first parsed
+        book and memory stays bounded.
+        """
         try:
-            library_root = await self._fetch_library_xml()
-            if not library_root:
+            library_file = await self._refresh_library_xml()
+            if not library_file:
                 return []
 
-            # Get all books
-            books = library_root.findall(".//book")
+            parsed: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            fetched: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
             content_files = []
-            batch_size = 100
+            total_books = 0
             successful_parses = 0
 
-            # Process books in batches
-            for i in range(0, len(books), batch_size):
-                batch = books[i:i + batch_size]
-                
-                # Process meta4 files in parallel
-                tasks = []
-                for book in batch:
-                    url = book.get("url", "")
-                    if url and url.endswith(".meta4"):
-                        task = asyncio.create_task(self._fetch_meta4_file(url))
-                        tasks.append((book, task))
-                
-                # Wait for all meta4 fetches to complete
-                if tasks:
-                    for book, task in tasks:
-                        try:
-                            mirrors, md5_hash = await task
-                            if mirrors:
-                                content_file = ContentFile(
-                                    name=book.get("name", ""),
-                                    path=book.get("name", ""),
-                                    url=book.get("url", ""),
-                                    size=int(book.get("size", 0)),
-                                    date=book.get("date", ""),
-                                    mirrors=mirrors,
-                                    md5_url=book.get("url", "")
-                                )
-                                content_files.append(content_file)
-                                successful_parses += 1
-                                if successful_parses % 25 == 0:
-                                    log.info("meta4_parse.status", successful_parses=successful_parses)
-                        except Exception as e:
-                            log.error("meta4_parse.failed",
-                                    name=book.get("name", ""),
-                                    error=str(e))
+            async def parse_books():
+                nonlocal total_books
+                async for book in _iter_library_books(library_file):
+                    total_books += 1
+                    if book.get("url", "").endswith(".meta4"):
+                        await parsed.put(book)
+                for _ in range(META4_FETCH_CONCURRENCY):
+                    await parsed.put(None)
+
+            async def fetch_meta4():
+                while (book := await parsed.get()) is not None:
+                    await fetched.put(await self._fetch_book_meta4(book, meta4_cache))
+
+            async def collect_results():
+                nonlocal successful_parses
+                while (result := await fetched.get()) is not None:
+                    book, mirrors, md5_hash = result
+                    if not mirrors:
+                        continue
+                    # A malformed entry is skipped on its own rather than
+                    # failing the whole pipeline
+                    try:
+                        content_file = ContentFile(
+                            name=book.get("name", ""),
+                            path=book.get("name", ""),
+                            url=book.get("url", ""),
+                            size=int(book.get("size", 0)),
+                            date=book.get("date", ""),
+                            mirrors=mirrors,
+                            md5_url=book.get("url", "")
+                        )
+                    except Exception as e:
+                        log.error("meta4_parse.failed",
+                                name=book.get("name", ""),
+                                error=str(e))
+                        continue
+                    content_files.append(content_file)
+                    successful_parses += 1
+                    if successful_parses % 25 == 0:
+                        log.info("meta4_parse.status", successful_parses=successful_parses)
+
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(parse_books())
+                tg.create_task(collect_results())
+                workers = [tg.create_task(fetch_meta4()) for _ in range(META4_FETCH_CONCURRENCY)]
+                await asyncio.gather(*workers)
+                await fetched.put(None)
 
             log.info("meta4_parse.complete", 
-                    total_processed=len(books), 
+                    total_processed=total_books, 
                     successful=successful_parses,
-                    failed=len(books) - successful_parses)
+                    failed=total_books - successful_parses)
             return content_files
 
         except Exception as e:
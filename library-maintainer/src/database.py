@@ -3,29 +3,442 @@ Database management for ApocaCache library maintainer.
 Handles storage of library and meta4 file information in SQLite.
 """
 
+import asyncio
 import os
+import queue
 import sqlite3
-import json
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from operator import itemgetter
+import orjson
 import structlog
-from typing import Dict, Optional, List, Set
+from typing import Dict, Iterator, Optional, List, Set
 
 log = structlog.get_logger()
 
+# Read-only connections kept open next to the single writer
+READER_POOL_SIZE = 4
+
+# Stored in PRAGMA user_version once the tables match this layout
+SCHEMA_VERSION = 6
+
+# Statements are kept as constants so the connection's statement cache
+# hits on every call instead of re-parsing the SQL text
+
+# Stored fields for a whole batch of books in one lookup; the ids are bound
+# as a single JSON array so the statement text stays the same whatever the
+# batch size
+_SQL_SELECT_BOOK_FIELDS_MANY = """
+SELECT id, url, size, media_count, article_count, book_date,
+       title, description, language, creator, publisher, name, tags
+FROM books WHERE id IN (SELECT value FROM json_each(?))
+"""
+
+_SQL_SELECT_ALL_MIRRORS = """
+SELECT book_id, url FROM mirror_urls
+ORDER BY book_id, priority
+"""
+
+_SQL_SELECT_ALL_TAGS = """
+SELECT book_id, tag FROM book_tags
+ORDER BY book_id, position
+"""
+
+# Every book with its meta4 info for the library listing. The favicon
+# columns are left out: they can hold inline image data that the listing
+# never shows
+_SQL_SELECT_LIBRARY = """
+SELECT b.id, b.url, b.size, b.media_count, b.article_count,
+       b.title, b.description, b.language, b.creator, b.publisher,
+       b.name, b.book_date, b.last_library_update, b.needs_meta4_update,
+       b.download_status, b.local_path,
+       m.file_size,
+       lower(hex(m.md5_hash)) AS md5_hash,
+       lower(hex(m.sha1_hash)) AS sha1_hash,
+       lower(hex(m.sha256_hash)) AS sha256_hash,
+       m.piece_length, m.last_meta4_update, m.meta4_url
+FROM books b
+LEFT JOIN meta4_info m ON b.id = m.book_id
+"""
+
+# A book, its meta4 row, mirrors and tags in one statement. Mirrors and
+# tags come back joined with the unit separator, which neither URLs nor tags
+# contain; hashes are stored as raw digest bytes and handed back as
+# lowercase hex
+_SQL_SELECT_BOOK_INFO = """
+SELECT b.id, b.url, b.size, b.media_count, b.article_count,
+       b.favicon, b.favicon_mime_type, b.title, b.description,
+       b.language, b.creator, b.publisher, b.name, b.tags,
+       b.book_date, b.last_library_update, b.needs_meta4_update,
+       b.download_status, b.local_path,
+       m.book_id,
+       lower(hex(m.md5_hash)) AS md5_hash,
+       lower(hex(m.sha1_hash)) AS sha1_hash,
+       lower(hex(m.sha256_hash)) AS sha256_hash,
+       m.piece_length, m.file_size, m.last_meta4_update, m.meta4_url,
+       (SELECT group_concat(url, char(31)) FROM
+            (SELECT url FROM mirror_urls WHERE book_id = b.id ORDER BY priority)
+       ) AS mirror_list,
+       (SELECT group_concat(tag, char(31)) FROM
+            (SELECT tag FROM book_tags WHERE book_id = b.id ORDER BY position)
+       ) AS tag_list
+FROM books b LEFT JOIN meta4_info m ON m.book_id = b.id
+WHERE b.id = ?
+"""
+
+_SQL_SELECT_BOOKS_NEEDING_META4 = """
+SELECT id, url, book_date
+FROM books
+WHERE needs_meta4_update = 1
+"""
+
+# Updated in place rather than deleted and re-inserted, so the row and its
+# index entries are rewritten once; the download state is reset as before
+_SQL_UPSERT_BOOK = """
+INSERT INTO books (
+    id, url, size, media_count, article_count,
+    favicon, favicon_mime_type, title, description,
+    language, creator, publisher, name, tags,
+    book_date, last_library_update, needs_meta4_update,
+    download_status
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'not_downloaded')
+ON CONFLICT(id) DO UPDATE SET
+    url = excluded.url,
+    size = excluded.size,
+    media_count = excluded.media_count,
+    article_count = excluded.article_count,
+    favicon = excluded.favicon,
+    favicon_mime_type = excluded.favicon_mime_type,
+    title = excluded.title,
+    description = excluded.description,
+    language = excluded.language,
+    creator = excluded.creator,
+    publisher = excluded.publisher,
+    name = excluded.name,
+    tags = excluded.tags,
+    book_date = excluded.book_date,
+    last_library_update = excluded.last_library_update,
+    needs_meta4_update = excluded.needs_meta4_update,
+    download_status = excluded.download_status,
+    local_path = NULL
+"""
+
+# Rows whose content is unchanged are left untouched, so the caller can tell
+# from the row count whether anything changed. Timestamps are stamped by
+# SQLite as integer epoch seconds
+_SQL_UPSERT_META4 = """
+INSERT INTO meta4_info (
+    book_id, md5_hash, sha1_hash,
+    sha256_hash, piece_length, file_size, last_meta4_update,
+    meta4_url, last_meta4_verified
+) VALUES (?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER), ?,
+          CAST(strftime('%s', 'now') AS INTEGER))
+ON CONFLICT(book_id) DO UPDATE SET
+    md5_hash = excluded.md5_hash,
+    sha1_hash = excluded.sha1_hash,
+    sha256_hash = excluded.sha256_hash,
+    piece_length = excluded.piece_length,
+    file_size = excluded.file_size,
+    last_meta4_update = excluded.last_meta4_update,
+    meta4_url = excluded.meta4_url,
+    last_meta4_verified = excluded.last_meta4_verified
+WHERE meta4_info.md5_hash IS NOT excluded.md5_hash
+   OR meta4_info.sha1_hash IS NOT excluded.sha1_hash
+   OR meta4_info.sha256_hash IS NOT excluded.sha256_hash
+   OR meta4_info.piece_length IS NOT excluded.piece_length
+   OR meta4_info.file_size IS NOT excluded.file_size
+   OR meta4_info.meta4_url IS NOT excluded.meta4_url
+"""
+
+# Created under a placeholder name so older databases can be rebuilt into
+# the current layout. last_meta4_update is when the content last changed,
+# last_meta4_verified when a fetched meta4 file last confirmed it
+_SQL_CREATE_META4_INFO = """
+CREATE TABLE IF NOT EXISTS {table} (
+    book_id TEXT PRIMARY KEY,
+    md5_hash BLOB,
+    sha1_hash BLOB,
+    sha256_hash BLOB,
+    piece_length INTEGER,
+    file_size INTEGER,
+    last_meta4_update INTEGER,
+    meta4_url TEXT,
+    last_meta4_verified INTEGER,
+    FOREIGN KEY (book_id) REFERENCES books(id)
+)
+"""
+
+# Child tables are clustered on their primary key, so a book's rows sit
+# together in key order with no separate rowid b-tree to maintain
+_SQL_CREATE_MIRROR_URLS = """
+CREATE TABLE IF NOT EXISTS {table} (
+    book_id TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (book_id, priority),
+    FOREIGN KEY (book_id) REFERENCES meta4_info(book_id)
+) WITHOUT ROWID
+"""
+
+_SQL_CREATE_BOOK_TAGS = """
+CREATE TABLE IF NOT EXISTS {table} (
+    book_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (book_id, position),
+    FOREIGN KEY (book_id) REFERENCES books(id)
+) WITHOUT ROWID
+"""
+
+# One row per process type, overwritten on every update
+_SQL_CREATE_PROCESSING_STATUS = """
+CREATE TABLE IF NOT EXISTS {table} (
+    process_type TEXT PRIMARY KEY,
+    total_items INTEGER NOT NULL DEFAULT 0,
+    processed_items INTEGER NOT NULL DEFAULT 0,
+    last_updated INTEGER,
+    is_complete INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Stamped on rows the upsert left untouched because nothing changed
+_SQL_MARK_META4_VERIFIED = """
+UPDATE meta4_info
+SET last_meta4_verified = CAST(strftime('%s', 'now') AS INTEGER)
+WHERE book_id = ?
+"""
+
+_SQL_SELECT_MIRRORS = """
+SELECT url FROM mirror_urls WHERE book_id = ? ORDER BY priority
+"""
+
+_SQL_DELETE_MIRRORS = """
+DELETE FROM mirror_urls WHERE book_id = ?
+"""
+
+_SQL_INSERT_MIRROR = """
+INSERT INTO mirror_urls (book_id, priority, url) VALUES (?, ?, ?)
+"""
+
+_SQL_DELETE_TAGS = """
+DELETE FROM book_tags WHERE book_id = ?
+"""
+
+_SQL_INSERT_TAG = """
+INSERT INTO book_tags (book_id, position, tag) VALUES (?, ?, ?)
+"""
+
+_SQL_SELECT_BOOKS_BY_TAG = """
+SELECT DISTINCT book_id FROM book_tags WHERE tag = ? ORDER BY book_id
+"""
+
+_SQL_SELECT_UNSPLIT_TAGS = """
+SELECT id, tags FROM books
+WHERE tags != ''
+  AND NOT EXISTS (SELECT 1 FROM book_tags t WHERE t.book_id = books.id)
+"""
+
+_SQL_CLEAR_META4_FLAG = """
+UPDATE books 
+SET needs_meta4_update = 0 
+WHERE id = ?
+"""
+
+# A NULL path leaves the stored one in place, so every status change shares
+# one statement
+_SQL_UPDATE_DOWNLOAD_STATUS = """
+UPDATE books
+SET download_status = ?, local_path = COALESCE(?, local_path)
+WHERE id = ?
+"""
+
+_SQL_FLAG_STALE_META4 = """
+UPDATE books
+SET needs_meta4_update = 1
+WHERE needs_meta4_update = 0
+  AND id IN (SELECT book_id FROM meta4_info WHERE last_meta4_verified < ?)
+"""
+
+_SQL_DELETE_OLD_STATUS = """
+DELETE FROM processing_status WHERE last_updated < ?
+"""
+
+_SQL_UPSERT_STATUS = """
+INSERT INTO processing_status 
+(process_type, total_items, processed_items, 
+ last_updated, is_complete, error_count)
+VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER), ?, ?)
+ON CONFLICT(process_type) DO UPDATE SET
+    total_items = excluded.total_items,
+    processed_items = excluded.processed_items,
+    last_updated = excluded.last_updated,
+    is_complete = excluded.is_complete,
+    error_count = excluded.error_count
+"""
+
+_SQL_SELECT_STATUS = """
+SELECT total_items, processed_items, last_updated,
+       is_complete, error_count
+FROM processing_status
+WHERE process_type = ?
+"""
+
+# Parameter tuples are pulled out of incoming dicts with one itemgetter call
+# after merging them over their defaults, rather than a .get() per column
+_BOOK_DEFAULTS = {
+    'url': '', 'size': 0, 'media_count': 0, 'article_count': 0,
+    'favicon': '', 'favicon_mime_type': '', 'title': '', 'description': '',
+    'language': '', 'creator': '', 'publisher': '', 'name': '', 'tags': '',
+    'book_date': ''
+}
+
+# Same order as the columns of _SQL_UPSERT_BOOK
+_book_values = itemgetter(
+    'id', 'url', 'size', 'media_count', 'article_count',
+    'favicon', 'favicon_mime_type', 'title', 'description',
+    'language', 'creator', 'publisher', 'name', 'tags', 'book_date'
+)
+
+# Same order as the compared columns of _SQL_SELECT_BOOK_FIELDS_MANY
+_book_compared = itemgetter(
+    'url', 'size', 'media_count', 'article_count', 'book_date',
+    'title', 'description', 'language', 'creator', 'publisher', 'name', 'tags'
+)
+
+_META4_INFO_FIELDS = (
+    'book_id', 'md5_hash', 'sha1_hash', 'sha256_hash',
+    'piece_length', 'file_size', 'last_meta4_update', 'meta4_url'
+)
+
+_META4_DEFAULTS = {
+    'md5_hash': '', 'sha1_hash': '', 'sha256_hash': '',
+    'piece_length': 0, 'file_size': 0, 'meta4_url': ''
+}
+
+_meta4_values = itemgetter(
+    'md5_hash', 'sha1_hash', 'sha256_hash', 'piece_length', 'file_size', 'meta4_url'
+)
+
+def _digest_bytes(value) -> Optional[bytes]:
+    """Convert a hex digest to the raw bytes stored in meta4_info."""
+    if not value or isinstance(value, bytes):
+        return value or None
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return None
+
 class DatabaseManager:
     """Manages SQLite database for library and meta4 file information."""
     
-    def __init__(self, data_dir: str):
-        """Initialize database connection."""
+    def __init__(self, data_dir: str, cache_mib: int = 64, mmap_mib: int = 1024):
+        """Initialize database connection.
+        
+        cache_mib sizes each connection's page cache; mmap_mib caps the
+        memory-mapped region, of which SQLite only maps what the file uses.
+        """
         self.db_path = os.path.join(data_dir, "library.db")
+        self._cache_mib = cache_mib
+        self._mmap_mib = mmap_mib
+        # One connection for the lifetime of the manager; sqlite3 connections
+        # are not safe for concurrent use, so every access holds the lock
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        # WAL is a property of the database file, so switching it once on the
+        # writer covers every connection opened afterwards
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Async callers hand writes to a single worker so commits overlap
+        # with network I/O instead of blocking the event loop
+        self._db_executor = ThreadPoolExecutor(max_workers=1,
+                                               thread_name_prefix="db-writer")
         self._initialize_database()
+        # Readers keep their page cache warm across calls; WAL lets them
+        # run alongside the writer without taking its lock. They are opened
+        # read-only so a stray write can never contend for the write lock
+        self._readers: queue.Queue = queue.Queue()
+        for _ in range(READER_POOL_SIZE):
+            self._readers.put(self._connect(read_only=True))
+    
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection and apply performance PRAGMAs."""
+        if read_only:
+            target = "file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(self.db_path))
+        else:
+            target = self.db_path
+        conn = sqlite3.connect(
+            target,
+            uri=read_only,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256
+        )
+        # Rows convert to dicts in C and still unpack like tuples
+        conn.row_factory = sqlite3.Row
+        # Safe under WAL: only checkpoints fsync, not every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # Negative cache_size is in KiB rather than pages
+        conn.execute(f"PRAGMA cache_size=-{int(self._cache_mib) * 1024}")
+        conn.execute(f"PRAGMA mmap_size={int(self._mmap_mib) * 1024 * 1024}")
+        # Wait out a competing writer instead of failing with SQLITE_BUSY
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run the enclosed statements in a single explicit transaction.
+        
+        The write lock is taken up front with BEGIN IMMEDIATE so a batch
+        never has to upgrade from a read lock midway through.
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+    
+    @contextmanager
+    def _acquire(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reader connection from the pool for the enclosed block."""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+    
+    def close(self):
+        """Close the writer and every pooled reader connection."""
+        self._db_executor.shutdown(wait=True)
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            if self._conn is not None:
+                # Refresh planner statistics for tables whose shape changed
+                # during this run; cheap when nothing needs analysing
+                try:
+                    self._conn.execute("PRAGMA optimize")
+                except sqlite3.Error as e:
+                    log.warning("database.optimize_failed", error=str(e))
+                self._conn.close()
+                self._conn = None
+                log.info("database.closed", path=self.db_path)
     
     def _initialize_database(self):
         """Initialize the database schema."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self._transaction() as cursor:
                 # Create books table
                 cursor.execute("""
                 CREATE TABLE IF NOT EXISTS books (
@@ -45,250 +458,483 @@ class DatabaseManager:
                     tags TEXT,
                     book_date TEXT,
                     last_library_update TEXT,
-                    needs_meta4_update BOOLEAN DEFAULT TRUE,
+                    needs_meta4_update INTEGER NOT NULL DEFAULT 1,
                     download_status TEXT DEFAULT 'not_downloaded',
                     local_path TEXT
                 )
                 """)
                 
                 # Create meta4_info table
+                cursor.execute(_SQL_CREATE_META4_INFO.format(table='meta4_info'))
+                
+                # Create mirror_urls table, one row per mirror in meta4 order
+                cursor.execute(_SQL_CREATE_MIRROR_URLS.format(table='mirror_urls'))
+                
+                # Create book_tags table, one row per ';'-separated library tag
+                cursor.execute(_SQL_CREATE_BOOK_TAGS.format(table='book_tags'))
+                
+                # Create processing_status table
+                cursor.execute(_SQL_CREATE_PROCESSING_STATUS.format(table='processing_status'))
+                
+                # Upgrades only run once per schema version rather than
+                # re-inspecting the tables on every start
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    self._migrate_schema(cursor, version)
+                    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    log.info("database.schema_upgraded",
+                            from_version=version,
+                            to_version=SCHEMA_VERSION)
+                
+                # Indexes for the age-based cleanup
                 cursor.execute("""
-                CREATE TABLE IF NOT EXISTS meta4_info (
-                    book_id TEXT PRIMARY KEY,
-                    mirrors TEXT,
-                    md5_hash TEXT,
-                    sha1_hash TEXT,
-                    sha256_hash TEXT,
-                    piece_length INTEGER,
-                    file_size INTEGER,
-                    last_meta4_update TEXT,
-                    meta4_url TEXT,
-                    FOREIGN KEY (book_id) REFERENCES books(id)
-                )
+                CREATE INDEX IF NOT EXISTS idx_meta4_info_last_verified
+                ON meta4_info (last_meta4_verified)
+                """)
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_processing_status_last_updated
+                ON processing_status (last_updated)
                 """)
                 
-                # Create processing_status table
+                # Covering index for the pending meta4 scan, so it is answered
+                # without touching the wide table rows. It is partial and only
+                # holds the pending books; the flag rides along as the last
+                # column so SQLite sees the index as covering
                 cursor.execute("""
-                CREATE TABLE IF NOT EXISTS processing_status (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    process_type TEXT NOT NULL,
-                    total_items INTEGER DEFAULT 0,
-                    processed_items INTEGER DEFAULT 0,
-                    last_updated TEXT,
-                    is_complete BOOLEAN DEFAULT FALSE,
-                    error_count INTEGER DEFAULT 0
-                )
+                CREATE INDEX IF NOT EXISTS idx_books_meta4_pending
+                ON books (id, url, book_date, needs_meta4_update)
+                WHERE needs_meta4_update = 1
+                """)
+                
+                # Tag lookups; the table's primary key rides along, so
+                # book_id is read straight from the index
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_book_tags_tag
+                ON book_tags (tag)
                 """)
                 
-                conn.commit()
                 log.info("database.initialized", path=self.db_path)
                 
         except Exception as e:
             log.error("database.init_failed", error=str(e))
             raise
     
-    def update_book_from_library(self, book_data: Dict) -> bool:
-        """Update or insert book data from library_zim.xml."""
+    def _migrate_schema(self, cursor: sqlite3.Cursor, version: int):
+        """Bring tables written by older versions up to the current layout."""
+        if version < 1:
+            self._migrate_to_v1(cursor)
+        if version < 2:
+            # Hex digests become raw bytes, half the size on disk
+            rows = cursor.execute(
+                "SELECT book_id, md5_hash, sha1_hash, sha256_hash FROM meta4_info"
+            ).fetchall()
+            cursor.executemany("""
+            UPDATE meta4_info
+            SET md5_hash = ?, sha1_hash = ?, sha256_hash = ?
+            WHERE book_id = ?
+            """, ((_digest_bytes(md5), _digest_bytes(sha1), _digest_bytes(sha256), book_id)
+                  for book_id, md5, sha1, sha256 in rows))
+        if version < 3:
+            # Rebuild the child tables clustered on their primary keys
+            for table, create in (('mirror_urls', _SQL_CREATE_MIRROR_URLS),
+                                  ('book_tags', _SQL_CREATE_BOOK_TAGS)):
+                cursor.execute(create.format(table=f'{table}_new'))
+                cursor.execute(f"INSERT INTO {table}_new SELECT * FROM {table}")
+                cursor.execute(f"DROP TABLE {table}")
+                cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        if version < 4:
+            # Replaced by the partial idx_books_meta4_pending
+            cursor.execute("DROP INDEX IF EXISTS idx_books_needs_meta4_cover")
+        if version < 5:
+            # Cleanup ages rows by when they were last verified, which
+            # existing rows were as of their last update
+            meta4_columns = [row[1] for row in cursor.execute("PRAGMA table_info(meta4_info)")]
+            if 'last_meta4_verified' not in meta4_columns:
+                cursor.execute("ALTER TABLE meta4_info ADD COLUMN last_meta4_verified INTEGER")
+            cursor.execute("""
+            UPDATE meta4_info SET last_meta4_verified = last_meta4_update
+            WHERE last_meta4_verified IS NULL
+            """)
+            cursor.execute("DROP INDEX IF EXISTS idx_meta4_info_last_update")
+        if version < 6:
+            # Only served the date-only pre-filter, which is gone
+            cursor.execute("DROP INDEX IF EXISTS idx_books_dates_cover")
+    
+    def _migrate_to_v1(self, cursor: sqlite3.Cursor):
+        """Normalize mirrors and tags and switch timestamps to epoch seconds."""
+        # Move mirrors stored as a JSON column by older versions
+        meta4_columns = [row[1] for row in cursor.execute("PRAGMA table_info(meta4_info)")]
+        if 'mirrors' in meta4_columns:
+            cursor.execute("""
+            INSERT OR IGNORE INTO mirror_urls (book_id, priority, url)
+            SELECT m.book_id, j.key, j.value
+            FROM meta4_info m, json_each(m.mirrors) j
+            WHERE json_valid(m.mirrors)
+            """)
+            cursor.execute("UPDATE meta4_info SET mirrors = NULL WHERE mirrors IS NOT NULL")
+        
+        # Older versions stored ISO text timestamps; rebuild the table
+        # with an integer epoch column, which also drops legacy columns
+        meta4_types = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(meta4_info)")}
+        if meta4_types['last_meta4_update'] != 'INTEGER':
+            cursor.execute(_SQL_CREATE_META4_INFO.format(table='meta4_info_new'))
+            cursor.execute("""
+            INSERT INTO meta4_info_new (
+                book_id, md5_hash, sha1_hash, sha256_hash,
+                piece_length, file_size, last_meta4_update, meta4_url
+            )
+            SELECT book_id, md5_hash, sha1_hash, sha256_hash,
+                   piece_length, file_size,
+                   CAST(strftime('%s', last_meta4_update, 'utc') AS INTEGER),
+                   meta4_url
+            FROM meta4_info
+            """)
+            cursor.execute("DROP TABLE meta4_info")
+            cursor.execute("ALTER TABLE meta4_info_new RENAME TO meta4_info")
+        
+        # Split tags that older versions kept only as the raw string
+        unsplit = cursor.execute(_SQL_SELECT_UNSPLIT_TAGS).fetchall()
+        cursor.executemany(_SQL_INSERT_TAG,
+                           (t for book_id, tags in unsplit
+                            for t in self._tag_rows(book_id, tags)))
+        
+        # Older versions appended a row per update; keep only the
+        # latest one for each type, converting ISO text timestamps
+        status_columns = [row[1] for row in cursor.execute("PRAGMA table_info(processing_status)")]
+        if 'id' in status_columns:
+            cursor.execute(_SQL_CREATE_PROCESSING_STATUS.format(table='processing_status_new'))
+            cursor.execute("""
+            INSERT INTO processing_status_new
+            SELECT process_type, total_items, processed_items,
+                   CASE typeof(last_updated)
+                       WHEN 'text' THEN CAST(strftime('%s', last_updated, 'utc') AS INTEGER)
+                       ELSE last_updated
+                   END,
+                   is_complete, error_count
+            FROM processing_status
+            WHERE id IN (SELECT MAX(id) FROM processing_status GROUP BY process_type)
+            """)
+            cursor.execute("DROP TABLE processing_status")
+            cursor.execute("ALTER TABLE processing_status_new RENAME TO processing_status")
+        
+        # Replaced by idx_books_meta4_pending
+        cursor.execute("DROP INDEX IF EXISTS idx_books_needs_meta4_update")
+    
+    def update_book_from_library(self, book_data: Dict, updated: Optional[str] = None) -> bool:
+        """Update or insert book data from library_zim.xml.
+        
+        Args:
+            book_data: Book fields parsed from the library
+            updated: Timestamp to record; callers updating many books pass
+                one shared value instead of formatting the time per row
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check if book exists and compare data
-                cursor.execute("""
-                SELECT size, media_count, article_count, book_date,
-                       title, description, language, creator, publisher, name, tags
-                FROM books WHERE id = ?
-                """, (book_data['id'],))
-                
-                existing = cursor.fetchone()
-                needs_update = True
-                
-                if existing:
-                    # Compare relevant fields to determine if update needed
-                    old_size, old_media_count, old_article_count, old_date, \
-                    old_title, old_desc, old_lang, old_creator, old_pub, old_name, old_tags = existing
-                    needs_update = (
-                        old_size != book_data.get('size', 0) or
-                        old_media_count != book_data.get('media_count', 0) or
-                        old_article_count != book_data.get('article_count', 0) or
-                        old_date != book_data.get('book_date', '') or
-                        old_title != book_data.get('title', '') or
-                        old_desc != book_data.get('description', '') or
-                        old_lang != book_data.get('language', '') or
-                        old_creator != book_data.get('creator', '') or
-                        old_pub != book_data.get('publisher', '') or
-                        old_name != book_data.get('name', '') or
-                        old_tags != book_data.get('tags', '')
-                    )
-                
-                if needs_update:
-                    log.info("database.updating_book",
-                            book_id=book_data['id'],
-                            title=book_data.get('title', ''),
-                            language=book_data.get('language', ''))
-                            
-                    cursor.execute("""
-                    INSERT OR REPLACE INTO books (
-                        id, url, size, media_count, article_count,
-                        favicon, favicon_mime_type, title, description,
-                        language, creator, publisher, name, tags,
-                        book_date, last_library_update, needs_meta4_update,
-                        download_status
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'not_downloaded')
-                    """, (
-                        book_data['id'],
-                        book_data.get('url', ''),
-                        book_data.get('size', 0),
-                        book_data.get('media_count', 0),
-                        book_data.get('article_count', 0),
-                        book_data.get('favicon', ''),
-                        book_data.get('favicon_mime_type', ''),
-                        book_data.get('title', ''),
-                        book_data.get('description', ''),
-                        book_data.get('language', ''),
-                        book_data.get('creator', ''),
-                        book_data.get('publisher', ''),
-                        book_data.get('name', ''),
-                        book_data.get('tags', ''),
-                        book_data.get('book_date', ''),
-                        datetime.now().isoformat(),
-                        True
-                    ))
-                
-                conn.commit()
-                return needs_update
+            # The diff runs outside any transaction so an unchanged book
+            # never takes the write lock or commits
+            with self._lock:
+                changed = self._changed_books(self._conn.cursor(), [book_data])
+            if not changed:
+                return False
+            
+            with self._transaction() as cursor:
+                self._write_books(cursor, changed, updated or datetime.now().isoformat())
+            return True
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             log.error("database.update_book_failed",
                      book_id=book_data.get('id', ''),
                      error=str(e))
             return False
     
+    async def batch_update_books_from_library(self, books: List[Dict], updated: str):
+        """Update or insert many library books in one transaction."""
+        if not books:
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._db_executor,
+                                   self._batch_update_books_sync, books, updated)
+    
+    def _batch_update_books_sync(self, books: List[Dict], updated: str):
+        """Write a batch of library books; runs on the writer thread."""
+        try:
+            with self._lock:
+                changed = self._changed_books(self._conn.cursor(), books)
+            if changed:
+                with self._transaction() as cursor:
+                    self._write_books(cursor, changed, updated)
+            log.info("database.books_batch_updated",
+                    count=len(books),
+                    changed=len(changed))
+                
+        except sqlite3.Error as e:
+            log.error("database.batch_update_books_failed",
+                     count=len(books),
+                     error=str(e))
+    
+    def _changed_books(self, cursor: sqlite3.Cursor, books: List[Dict]) -> List[Dict]:
+        """Return the books whose stored fields differ from the library.
+        
+        Each returned dict is merged over the column defaults, ready for
+        _write_books.
+        """
+        cursor.execute(_SQL_SELECT_BOOK_FIELDS_MANY,
+                       (orjson.dumps([b['id'] for b in books]).decode(),))
+        existing = {row[0]: row[1:] for row in cursor.fetchall()}
+        
+        changed = []
+        for book_data in books:
+            book = {**_BOOK_DEFAULTS, **book_data}
+            if existing.get(book['id']) != _book_compared(book):
+                log.debug("database.updating_book",
+                         book_id=book['id'],
+                         title=book['title'],
+                         language=book['language'])
+                changed.append(book)
+        return changed
+    
+    def _write_books(self, cursor: sqlite3.Cursor, books: List[Dict], updated: str):
+        """Upsert books and rewrite their tags inside the caller's transaction."""
+        # Rows and their tags go out as one executemany per statement
+        cursor.executemany(_SQL_UPSERT_BOOK,
+                           (_book_values(b) + (updated, 1) for b in books))
+        cursor.executemany(_SQL_DELETE_TAGS, ((b['id'],) for b in books))
+        cursor.executemany(_SQL_INSERT_TAG,
+                           (t for b in books for t in self._tag_rows(b['id'], b['tags'])))
+    
     def update_meta4_info(self, book_id: str, meta4_data: Dict):
         """Update meta4 information for a book."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self._transaction() as cursor:
                 # Insert/update meta4 info
-                cursor.execute("""
-                INSERT OR REPLACE INTO meta4_info (
-                    book_id, mirrors, md5_hash, sha1_hash,
-                    sha256_hash, piece_length, file_size, last_meta4_update,
-                    meta4_url
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    book_id,
-                    json.dumps(meta4_data.get('mirrors', [])),
-                    meta4_data.get('md5_hash', ''),
-                    meta4_data.get('sha1_hash', ''),
-                    meta4_data.get('sha256_hash', ''),
-                    meta4_data.get('piece_length', 0),
-                    meta4_data.get('file_size', 0),
-                    datetime.now().isoformat(),
-                    meta4_data.get('meta4_url', '')
-                ))
+                self._write_meta4(cursor, book_id, meta4_data)
                 
                 # Mark book as not needing meta4 update
-                cursor.execute("""
-                UPDATE books 
-                SET needs_meta4_update = 0 
-                WHERE id = ?
-                """, (book_id,))
+                cursor.execute(_SQL_CLEAR_META4_FLAG, (book_id,))
                 
-                conn.commit()
                 log.info("database.meta4_updated",
                         book_id=book_id)
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             log.error("database.update_meta4_failed",
                      book_id=book_id,
                      error=str(e))
     
+    async def batch_update_meta4_info(self, updates: List[Dict]):
+        """Update meta4 information for many books in one transaction."""
+        if not updates:
+            return
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._db_executor,
+                                   self._batch_update_meta4_sync, updates)
+    
+    def _batch_update_meta4_sync(self, updates: List[Dict]):
+        """Write a batch of meta4 updates; runs on the writer thread."""
+        try:
+            with self._transaction() as cursor:
+                for u in updates:
+                    self._write_meta4(cursor, u['book_id'], u)
+                cursor.executemany(_SQL_CLEAR_META4_FLAG,
+                                   ((u['book_id'],) for u in updates))
+                log.info("database.meta4_batch_updated",
+                        count=len(updates))
+                
+        except sqlite3.Error as e:
+            log.error("database.batch_update_meta4_failed",
+                     count=len(updates),
+                     error=str(e))
+    
+    def _write_meta4(self, cursor: sqlite3.Cursor, book_id: str, meta4_data: Dict):
+        """Upsert a book's meta4 info inside the caller's transaction.
+        
+        Mirrors are only rewritten when they or the meta4 row changed; an
+        unchanged row just has its verification time stamped.
+        """
+        cursor.execute(_SQL_UPSERT_META4, self._meta4_row(book_id, meta4_data))
+        if cursor.rowcount == 0:
+            cursor.execute(_SQL_MARK_META4_VERIFIED, (book_id,))
+            stored = [url for url, in cursor.execute(_SQL_SELECT_MIRRORS, (book_id,))]
+            if stored == list(meta4_data.get('mirrors', [])):
+                return
+        cursor.execute(_SQL_DELETE_MIRRORS, (book_id,))
+        cursor.executemany(_SQL_INSERT_MIRROR,
+                           self._mirror_rows(book_id, meta4_data))
+    
+    @staticmethod
+    def _meta4_row(book_id: str, meta4_data: Dict) -> tuple:
+        """Build the meta4_info parameter tuple for a book."""
+        md5, sha1, sha256, piece_length, file_size, meta4_url = \
+            _meta4_values({**_META4_DEFAULTS, **meta4_data})
+        return (book_id, _digest_bytes(md5), _digest_bytes(sha1), _digest_bytes(sha256),
+                piece_length, file_size, meta4_url)
+    
+    @staticmethod
+    def _tag_rows(book_id: str, tags: Optional[str]) -> Iterator[tuple]:
+        """Yield the book_tags parameter tuples for a library tags string."""
+        return (
+            (book_id, position, tag)
+            for position, tag in enumerate(t for t in (tags or '').split(';') if t)
+        )
+    
+    @staticmethod
+    def _mirror_rows(book_id: str, meta4_data: Dict) -> Iterator[tuple]:
+        """Yield the mirror_urls parameter tuples for a book."""
+        return (
+            (book_id, priority, url)
+            for priority, url in enumerate(meta4_data.get('mirrors', []))
+        )
+    
+    def cleanup_old_entries(self, days: int = 30) -> int:
+        """Queue stale meta4 info for a refetch and drop old processing status.
+        
+        Stale meta4 info is kept until the refetch replaces it, so downloads
+        of those books keep working in the meantime.
+        
+        Returns:
+            Number of books newly flagged for a meta4 refetch
+        """
+        # Compare against a precomputed cutoff so the indexes can be used
+        cutoff = int(time.time()) - days * 86400
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(_SQL_FLAG_STALE_META4, (cutoff,))
+                meta4_flagged = cursor.rowcount
+                cursor.execute(_SQL_DELETE_OLD_STATUS, (cutoff,))
+                status_removed = cursor.rowcount
+                
+                log.info("database.cleanup_complete",
+                        days=days,
+                        meta4_flagged=meta4_flagged,
+                        status_removed=status_removed)
+                return meta4_flagged
+                
+        except sqlite3.Error as e:
+            log.error("database.cleanup_failed",
+                     days=days,
+                     error=str(e))
+            return 0
+    
     def get_books_needing_meta4_update(self) -> List[Dict]:
         """Get list of books that need meta4 updates."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._acquire() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                SELECT id, url, book_date
-                FROM books
-                WHERE needs_meta4_update = 1
-                """)
+                cursor.execute(_SQL_SELECT_BOOKS_NEEDING_META4)
                 
                 return [{
                     'id': row[0],
                     'url': row[1],
                     'date': row[2]
-                } for row in cursor.fetchall()]
+                } for row in cursor]
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             log.error("database.get_needs_update_failed", error=str(e))
             return []
     
     def get_book_info(self, book_id: str) -> Optional[Dict]:
         """Get complete book information including meta4 data."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._acquire() as conn:
+                row = conn.execute(_SQL_SELECT_BOOK_INFO, (book_id,)).fetchone()
+            if not row:
+                return None
+            
+            book_data = dict(row)
+            mirrors = book_data.pop('mirror_list')
+            tags = book_data.pop('tag_list')
+            meta4_data = {key: book_data.pop(key) for key in _META4_INFO_FIELDS}
+            
+            # The meta4 columns are all NULL when the join found no row
+            if meta4_data['book_id'] is not None:
+                meta4_data['mirrors'] = mirrors.split('\x1f') if mirrors else []
+                book_data['meta4_info'] = meta4_data
+            
+            book_data['tags'] = tags.split('\x1f') if tags else []
+            return book_data
+                
+        except sqlite3.Error as e:
+            log.error("database.get_book_failed",
+                     book_id=book_id,
+                     error=str(e))
+            return None
+    
+    def load_library_books(self) -> List[Dict]:
+        """Get every book with its meta4 info, mirrors and tags.
+        
+        Errors are logged and raised, so callers never mistake a failed
+        read for an empty library.
+        """
+        try:
+            with self._acquire() as conn:
                 cursor = conn.cursor()
                 
-                # Get book data
-                cursor.execute("SELECT * FROM books WHERE id = ?", (book_id,))
-                book_row = cursor.fetchone()
-                if not book_row:
-                    return None
+                # Load every mirror and tag up front rather than querying per book
+                mirrors_by_book: Dict[str, List[str]] = {}
+                cursor.execute(_SQL_SELECT_ALL_MIRRORS)
+                for book_id, url in cursor:
+                    mirrors_by_book.setdefault(book_id, []).append(url)
                 
-                # Convert to dict
-                columns = [desc[0] for desc in cursor.description]
-                book_data = dict(zip(columns, book_row))
+                tags_by_book: Dict[str, List[str]] = {}
+                cursor.execute(_SQL_SELECT_ALL_TAGS)
+                for book_id, tag in cursor:
+                    tags_by_book.setdefault(book_id, []).append(tag)
                 
-                # Get meta4 info
-                cursor.execute("SELECT * FROM meta4_info WHERE book_id = ?", (book_id,))
-                meta4_row = cursor.fetchone()
-                if meta4_row:
-                    meta4_columns = [desc[0] for desc in cursor.description]
-                    meta4_data = dict(zip(meta4_columns, meta4_row))
-                    
-                    # Parse JSON fields
-                    if meta4_data.get('mirrors'):
-                        meta4_data['mirrors'] = json.loads(meta4_data['mirrors'])
-                    
-                    book_data['meta4_info'] = meta4_data
+                # Convert rows as the cursor yields them
+                books = []
+                for row in cursor.execute(_SQL_SELECT_LIBRARY):
+                    book_data = dict(row)
+                    book_data['mirrors'] = mirrors_by_book.get(book_data['id'], [])
+                    book_data['tags'] = tags_by_book.get(book_data['id'], [])
+                    books.append(book_data)
+                return books
                 
-                # Parse JSON fields
-                if book_data.get('tags'):
-                    book_data['tags'] = json.loads(book_data['tags'])
+        except sqlite3.Error as e:
+            log.error("database.load_library_failed", error=str(e))
+            raise
+    
+    def find_books_by_tag(self, tag: str) -> List[str]:
+        """Get the ids of books carrying the given tag."""
+        try:
+            with self._acquire() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_SELECT_BOOKS_BY_TAG, (tag,))
+                return [row[0] for row in cursor]
                 
-                return book_data
+        except sqlite3.Error as e:
+            log.error("database.find_by_tag_failed",
+                     tag=tag,
+                     error=str(e))
+            return []
+    
+    def update_download_status(self, book_id: str, status: str,
+                               local_path: Optional[str] = None):
+        """Record a book's download status and, when given, its local path."""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(_SQL_UPDATE_DOWNLOAD_STATUS,
+                               (status, local_path, book_id))
                 
-        except Exception as e:
-            log.error("database.get_book_failed",
+        except sqlite3.Error as e:
+            log.error("database.download_status_failed",
                      book_id=book_id,
+                     status=status,
                      error=str(e))
-            return None
     
     def update_processing_status(self, process_type: str, total: int, processed: int,
                                is_complete: bool = False, error_count: int = 0):
         """Update processing status for library or meta4 updates."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                INSERT INTO processing_status 
-                (process_type, total_items, processed_items, 
-                 last_updated, is_complete, error_count)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """, (
+            with self._transaction() as cursor:
+                cursor.execute(_SQL_UPSERT_STATUS, (
                     process_type,
                     total,
                     processed,
-                    datetime.now().isoformat(),
-                    is_complete,
+                    int(is_complete),
                     error_count
                 ))
-                conn.commit()
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             log.error("database.status_update_failed",
                      process_type=process_type,
                      error=str(e))
@@ -296,22 +942,17 @@ class DatabaseManager:
     def get_processing_status(self, process_type: str) -> Dict:
         """Get latest processing status for a given type."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._acquire() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                SELECT total_items, processed_items, last_updated,
-                       is_complete, error_count
-                FROM processing_status
-                WHERE process_type = ?
-                ORDER BY id DESC LIMIT 1
-                """, (process_type,))
+                cursor.execute(_SQL_SELECT_STATUS, (process_type,))
                 
                 row = cursor.fetchone()
                 if row:
                     return {
                         "total_items": row[0],
                         "processed_items": row[1],
-                        "last_updated": row[2],
+                        "last_updated": (datetime.fromtimestamp(row[2]).isoformat()
+                                         if row[2] is not None else None),
                         "is_complete": bool(row[3]),
                         "error_count": row[4]
                     }
@@ -323,7 +964,7 @@ class DatabaseManager:
                     "error_count": 0
                 }
                 
-        except Exception as e:
+        except sqlite3.Error as e:
             log.error("database.status_get_failed",
                      process_type=process_type,
                      error=str(e))
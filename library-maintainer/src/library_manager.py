@@ -3,22 +3,23 @@ Library management for ApocaCache library maintainer.
 Handles library.xml generation and management for Kiwix-serve.
 """
 
+import asyncio
 import os
 import time
-from typing import Dict, List, Optional, Set
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-import aiofiles
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from lxml import etree as ET
 import structlog
 import traceback
 import re
-from datetime import datetime
 
 from config import Config, ContentItem
 import monitoring
 
 log = structlog.get_logger()
 
+# Trailing _YYYY-MM version of a ZIM filename
+_VERSION_RE = re.compile(r'_(\d{4}-\d{2})\.zim$')
+
 class LibraryManager:
     """Manages the library.xml file for Kiwix-serve."""
     
@@ -26,8 +27,14 @@ class LibraryManager:
         """Initialize the library manager."""
         self.config = config
         self._processed_files: Set[str] = set()
+        # filepath -> ((size, mtime_ns), metadata) from the last library
+        # update, so unchanged files skip metadata extraction
+        self._metadata_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+        # The main loop and finished downloads both rebuild the library; one
+        # build at a time owns the temp file, the cache and the rename
+        self._update_lock = asyncio.Lock()
     
-    def _get_zim_metadata(self, filepath: str) -> Dict[str, str]:
+    def _get_zim_metadata(self, filepath: str, size: Optional[int] = None) -> Dict[str, str]:
         """Extract metadata from a ZIM file."""
         # TODO: Implement ZIM file metadata extraction
         # For now, return basic metadata from filename
@@ -69,147 +76,205 @@ class LibraryManager:
             'favicon': '',
             'favicon_mime_type': '',
             'tags': f'_category:{category};_ftindex:yes',  # Add basic tags
-            'size': str(os.path.getsize(filepath))
+            'size': str(os.path.getsize(filepath) if size is None else size)
         }
     
+    def _scan_zim_files(self, path: str) -> Iterator[Tuple[str, str, int, int]]:
+        """Yield (filepath, filename, size, mtime_ns) for every ZIM under path.
+        
+        Walks in the same top-down order as os.walk, but reads sizes from
+        the DirEntry stat so each file is stat'ed once.
+        """
+        try:
+            with os.scandir(path) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir():
+                        # Like os.walk, don't descend into symlinked dirs
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif entry.name.endswith('.zim'):
+                        try:
+                            st = entry.stat()
+                        except OSError as e:
+                            log.error("library_update.stat_failed",
+                                    filename=entry.name,
+                                    error=str(e))
+                            continue
+                        yield entry.path, entry.name, st.st_size, st.st_mtime_ns
+        except OSError as e:
+            log.error("library_update.scan_failed", path=path, error=str(e))
+            return
+        
+        for subdir in subdirs:
+            yield from self._scan_zim_files(subdir)
+    
     def _get_base_name(self, filename: str) -> str:
         """Get the base name without version from filename."""
-        return re.sub(r'_\d{4}-\d{2}\.zim$', '', filename)
+        return _VERSION_RE.sub('', filename)
     
     def _is_newer_version(self, current: str, new: str) -> bool:
         """Check if new version is newer than current version."""
-        try:
-            current_match = re.search(r'_(\d{4}-\d{2})\.zim$', current)
-            new_match = re.search(r'_(\d{4}-\d{2})\.zim$', new)
-            if current_match and new_match:
-                current_date = datetime.strptime(current_match.group(1), "%Y-%m")
-                new_date = datetime.strptime(new_match.group(1), "%Y-%m")
-                return new_date > current_date
-            return False
-        except (ValueError, AttributeError):
-            return False
+        current_match = _VERSION_RE.search(current)
+        new_match = _VERSION_RE.search(new)
+        if current_match and new_match:
+            # Zero-padded YYYY-MM sorts the same as the date it names
+            return new_match.group(1) > current_match.group(1)
+        return False
     
-    async def update_library(self):
-        """Update the library.xml file with current content."""
-        start_time = time.time()
-        log.info("library_update.starting")
-        temp_file = None
+    def _build_book(self, filepath: str, filename: str, size: int,
+                    metadata: Dict[str, str]) -> ET._Element:
+        """Build the <book> element for one ZIM file."""
+        # Get relative path from data directory
+        rel_path = os.path.relpath(filepath, self.config.data_dir)
         
-        try:
-            # Create root element
-            root = ET.Element('library')
-            root.set('version', '20110515')
-            
-            # Track total library size
-            total_size = 0
-            book_count = 0
-            
-            # Keep track of processed base names to handle versioning
-            processed_base_names = {}
-            
-            # First pass: collect all files and their versions
-            all_files = []
-            for root_dir, dirs, files in os.walk(self.config.data_dir):
-                for filename in files:
-                    if filename.endswith('.zim'):
-                        filepath = os.path.join(root_dir, filename)
-                        base_name = self._get_base_name(filename)
-                        if base_name in processed_base_names:
-                            # Compare versions
-                            if self._is_newer_version(processed_base_names[base_name], filename):
-                                processed_base_names[base_name] = filename
-                        else:
-                            processed_base_names[base_name] = filename
-                        all_files.append((filepath, filename))
-            
-            # Second pass: add only the latest versions to library.xml
-            for filepath, filename in all_files:
-                base_name = self._get_base_name(filename)
-                if processed_base_names[base_name] == filename:
-                    try:
-                        # Get relative path from data directory
-                        rel_path = os.path.relpath(filepath, self.config.data_dir)
-                        size = os.path.getsize(filepath)
-                        total_size += size
-                        
-                        # Get metadata
-                        metadata = self._get_zim_metadata(filepath)
-                        
-                        # Create book element with all attributes
-                        book = ET.SubElement(root, 'book')
-                        # Generate ID from filename if not present
-                        book_id = metadata.get('id', os.path.splitext(os.path.basename(filepath))[0])
-                        book.set('id', book_id)
-                        book.set('path', rel_path)
-                        book.set('size', str(size))
-                        book.set('mediaCount', metadata.get('media_count', '0'))
-                        book.set('articleCount', metadata.get('article_count', '0'))
-                        book.set('favicon', metadata.get('favicon', ''))
-                        book.set('faviconMimeType', metadata.get('favicon_mime_type', ''))
-                        
-                        # Add metadata elements
-                        ET.SubElement(book, 'title').text = metadata.get('title', '')
-                        ET.SubElement(book, 'description').text = metadata.get('description', '')
-                        ET.SubElement(book, 'language').text = metadata.get('language', '')
-                        ET.SubElement(book, 'creator').text = metadata.get('creator', '')
-                        ET.SubElement(book, 'publisher').text = metadata.get('publisher', '')
-                        ET.SubElement(book, 'name').text = metadata.get('name', '')
-                        ET.SubElement(book, 'tags').text = metadata.get('tags', '')
-                        ET.SubElement(book, 'date').text = metadata.get('date', '')
+        # Create book element with all attributes
+        book = ET.Element('book')
+        # Generate ID from filename if not present
+        book_id = metadata.get('id', os.path.splitext(os.path.basename(filepath))[0])
+        book.set('id', book_id)
+        book.set('path', rel_path)
+        book.set('size', str(size))
+        book.set('mediaCount', metadata.get('media_count', '0'))
+        book.set('articleCount', metadata.get('article_count', '0'))
+        book.set('favicon', metadata.get('favicon', ''))
+        book.set('faviconMimeType', metadata.get('favicon_mime_type', ''))
+        
+        # Add metadata elements
+        ET.SubElement(book, 'title').text = metadata.get('title', '')
+        ET.SubElement(book, 'description').text = metadata.get('description', '')
+        ET.SubElement(book, 'language').text = metadata.get('language', '')
+        ET.SubElement(book, 'creator').text = metadata.get('creator', '')
+        ET.SubElement(book, 'publisher').text = metadata.get('publisher', '')
+        ET.SubElement(book, 'name').text = metadata.get('name', '')
+        ET.SubElement(book, 'tags').text = metadata.get('tags', '')
+        ET.SubElement(book, 'date').text = metadata.get('date', '')
+        
+        # Add URL for source
+        if os.getenv("TESTING", "false").lower() == "true":
+            url = "https://github.com/openzim/zim-tools/blob/main/test/data/zimfiles/good.zim"
+        else:
+            # Extract category from filepath
+            category = os.path.basename(os.path.dirname(filepath))
+            url = f"{self.config.base_url}{category}/{filename}"
+        ET.SubElement(book, 'url').text = url
+        
+        log.debug("library_update.added_book",
+                title=metadata.get('title', ''),
+                language=metadata.get('language', ''),
+                size=size,
+                version=metadata.get('date', ''))
+        return book
+    
+    def _write_library_xml(self, path: str, books: List[Tuple[str, str, int, int]]):
+        """Stream the library to path one book at a time.
+        
+        Each <book> is written and dropped as soon as it is built, so memory
+        stays at one book instead of the whole tree plus its serialization.
+        Returns the total size and number of books written.
+        """
+        total_size = 0
+        book_count = 0
+        # Rebuilt every run, which also drops files that have gone away
+        metadata_cache = {}
+        
+        with open(path, 'wb') as f:
+            with ET.xmlfile(f, encoding='utf-8') as xf:
+                xf.write_declaration()
+                with xf.element('library', version='20110515'):
+                    for filepath, filename, size, mtime_ns in books:
+                        try:
+                            stamp = (size, mtime_ns)
+                            cached = self._metadata_cache.get(filepath)
+                            if cached and cached[0] == stamp:
+                                metadata = cached[1]
+                            else:
+                                metadata = self._get_zim_metadata(filepath, size)
+                            metadata_cache[filepath] = (stamp, metadata)
+                            book = self._build_book(filepath, filename, size, metadata)
+                        except Exception as book_error:
+                            log.error("library_update.book_failed",
+                                    filename=filename,
+                                    error=str(book_error))
+                            continue
                         
-                        # Add URL for source
-                        if os.getenv("TESTING", "false").lower() == "true":
-                            url = "https://github.com/openzim/zim-tools/blob/main/test/data/zimfiles/good.zim"
-                        else:
-                            # Extract category from filepath
-                            category = os.path.basename(os.path.dirname(filepath))
-                            url = f"{self.config.base_url}{category}/{filename}"
-                        ET.SubElement(book, 'url').text = url
+                        # Indent as a child of <library>, matching pretty_print
+                        ET.indent(book, space="  ", level=1)
+                        xf.write("\n  ")
+                        xf.write(book)
+                        total_size += size
                         book_count += 1
-                        
-                        log.debug("library_update.added_book",
-                                title=metadata.get('title', ''),
-                                language=metadata.get('language', ''),
-                                size=size,
-                                version=metadata.get('date', ''))
-                    except Exception as book_error:
-                        log.error("library_update.book_failed",
-                                filename=filename,
-                                error=str(book_error))
-                        continue
-            
-            # Format XML with proper indentation
-            xml_str = minidom.parseString(ET.tostring(root)).toprettyxml(indent="  ")
+                    xf.write("\n")
+            f.write(b"\n")
+            # On disk before the rename makes it visible
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self._metadata_cache = metadata_cache
+        return total_size, book_count
+    
+    def _build_library_xml(self, path: str) -> Tuple[int, int]:
+        """Scan the data directory and write its latest ZIMs to path.
+        
+        Blocking; update_library runs it in a worker thread.
+        """
+        # Keep only the latest version of each base name, in one pass
+        latest: Dict[str, Tuple[str, str, int, int]] = {}
+        for entry in self._scan_zim_files(self.config.data_dir):
+            base_name = self._get_base_name(entry[1])
+            current = latest.get(base_name)
+            if current is None or self._is_newer_version(current[1], entry[1]):
+                latest[base_name] = entry
+        
+        return self._write_library_xml(path, list(latest.values()))
+    
+    def _replace_library_file(self, temp_file: str):
+        """Atomically move temp_file over library.xml and persist the rename."""
+        os.rename(temp_file, self.config.library_file)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.config.library_file)),
+                         os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    async def update_library(self):
+        """Update the library.xml file with current content."""
+        async with self._update_lock:
+            start_time = time.time()
+            log.info("library_update.starting")
+            temp_file = None
             
-            # Write to temporary file first
-            temp_file = f"{self.config.library_file}.tmp"
-            async with aiofiles.open(temp_file, 'w', encoding='utf-8') as f:
-                await f.write(xml_str)
+            try:
+                # Scan and write to a temporary file, off the event loop
+                temp_file = f"{self.config.library_file}.tmp"
+                total_size, book_count = await asyncio.to_thread(
+                    self._build_library_xml, temp_file)
             
-            # Atomically replace the old file
-            os.rename(temp_file, self.config.library_file)
+                # Atomically replace the old file
+                await asyncio.to_thread(self._replace_library_file, temp_file)
             
-            # Update metrics
-            monitoring.set_library_size(total_size)
+                # Update metrics
+                monitoring.set_library_size(total_size)
             
-            duration = time.time() - start_time
-            log.info("library_update.complete",
-                     duration=duration,
-                     total_size=total_size,
-                     books=book_count,
-                     library_file=self.config.library_file)
+                duration = time.time() - start_time
+                log.info("library_update.complete",
+                         duration=duration,
+                         total_size=total_size,
+                         books=book_count,
+                         library_file=self.config.library_file)
             
-        except Exception as e:
-            log.error("library_update.failed", 
-                     error=str(e),
-                     traceback=traceback.format_exc())
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except Exception as cleanup_error:
-                    log.error("library_update.cleanup_failed", 
-                             error=str(cleanup_error))
-            raise  # Re-raise to ensure the error is properly handled
+            except Exception as e:
+                log.error("library_update.failed", 
+                         error=str(e),
+                         traceback=traceback.format_exc())
+                if temp_file and os.path.exists(temp_file):
+                    try:
+                        os.remove(temp_file)
+                    except Exception as cleanup_error:
+                        log.error("library_update.cleanup_failed", 
+                                 error=str(cleanup_error))
+                raise  # Re-raise to ensure the error is properly handled
     
     async def cleanup(self):
         """Clean up temporary library files."""
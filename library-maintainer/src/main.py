@@ -10,7 +10,8 @@ import os
 import signal
 import sys
 import shutil
-from typing import Set
+from datetime import datetime
+from typing import List, Set
 
 import structlog
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -32,7 +33,10 @@ structlog.configure(
     ],
     context_class=dict,
     logger_factory=structlog.PrintLoggerFactory(),
-    wrapper_class=structlog.BoundLogger,
+    # Calls below the configured level return immediately without rendering
+    wrapper_class=structlog.make_filtering_bound_logger(
+        getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    ),
     cache_logger_on_first_use=True,
 )
 
@@ -45,7 +49,9 @@ class LibraryMaintainerService:
         self.config = Config()
         self.content_manager = ContentManager(self.config)
         self.library_manager = LibraryManager(self.config)
-        self.db_manager = DatabaseManager(self.config.data_dir)
+        self.db_manager = DatabaseManager(self.config.data_dir,
+                                          self.config.db_cache_mib,
+                                          self.config.db_mmap_mib)
         self.scheduler = AsyncIOScheduler()
         self.running = False
         self._setup_signal_handlers()
@@ -68,7 +74,7 @@ class LibraryMaintainerService:
             # Then update the library catalog
             await self.library_manager.update_library()
             # Clean up old cache entries
-            self.db_manager.cleanup_old_entries(days=30)
+            await asyncio.to_thread(self.db_manager.cleanup_old_entries, days=30)
             log.info("update_cycle.complete")
         except Exception as e:
             log.error("update_cycle.failed", error=str(e))
@@ -113,6 +119,7 @@ class LibraryMaintainerService:
         log.info("service.shutting_down")
         self.scheduler.shutdown()
         await self.content_manager.cleanup()
+        self.db_manager.close()
         log.info("service.shutdown_complete")
 
 async def initialize_library_xml(config: Config) -> bool:
@@ -162,10 +169,13 @@ async def initialize_database(config: Config, content_manager: ContentManager, d
         
         log.info("database.populating", total_books=total_books)
         
+        updated = datetime.now().isoformat()
+        
         # Process books in batches
         batch_size = 100
         for i in range(0, total_books, batch_size):
             batch = books[i:i + batch_size]
+            books_data = []
             
             # Process each book in the batch
             for book in batch:
@@ -187,7 +197,7 @@ async def initialize_database(config: Config, content_manager: ContentManager, d
                         'name': book.find('.//name').text if book.find('.//name') is not None else '',
                         'tags': book.find('.//tags').text if book.find('.//tags') is not None else '',
                         'book_date': book.find('.//date').text if book.find('.//date') is not None else '',
-                        'needs_meta4_update': True
+                        'needs_meta4_update': 1
                     }
                     
                     # Clean up text fields
@@ -195,8 +205,8 @@ async def initialize_database(config: Config, content_manager: ContentManager, d
                         if book_data[key]:
                             book_data[key] = book_data[key].strip()
                     
-                    # Update book in database
-                    db_manager.update_book_from_library(book_data)
+                    # The database diffs the whole batch and only writes changed books
+                    books_data.append(book_data)
                     processed += 1
                     
                     if processed % 100 == 0:
@@ -210,13 +220,16 @@ async def initialize_database(config: Config, content_manager: ContentManager, d
                              book_id=book.get('id', 'unknown'),
                              error=str(e))
                     continue
+            
+            # Write the batch off the event loop
+            await db_manager.batch_update_books_from_library(books_data, updated)
         
         log.info("database.population_complete",
                  total_processed=processed,
                  total_books=total_books)
         
         # Start meta4 file processing
-        books_needing_meta4 = db_manager.get_books_needing_meta4_update()
+        books_needing_meta4 = await asyncio.to_thread(db_manager.get_books_needing_meta4_update)
         if books_needing_meta4:
             log.info("database.processing_meta4_files",
                      count=len(books_needing_meta4))
@@ -230,23 +243,27 @@ async def initialize_database(config: Config, content_manager: ContentManager, d
                 for book in batch:
                     if book['url'] and book['url'].endswith('.meta4'):
                         task = asyncio.create_task(content_manager._fetch_meta4_file(book['url']))
-                        tasks.append((book['id'], task))
+                        tasks.append((book, task))
                 
                 # Wait for batch to complete
-                for book_id, task in tasks:
+                updates = []
+                for book, task in tasks:
                     try:
                         mirrors, md5_hash = await task
                         if mirrors:
-                            meta4_data = {
+                            updates.append({
+                                'book_id': book['id'],
                                 'mirrors': mirrors,
                                 'md5_hash': md5_hash,
                                 'meta4_url': book['url']
-                            }
-                            db_manager.update_meta4_info(book_id, meta4_data)
+                            })
                     except Exception as e:
                         log.error("database.meta4_processing_failed",
-                                 book_id=book_id,
+                                 book_id=book['id'],
                                  error=str(e))
+                
+                # Write the batch off the event loop
+                await db_manager.batch_update_meta4_info(updates)
         
         return True
         
@@ -268,7 +285,9 @@ async def main():
         # Initialize managers
         content_manager = ContentManager(config)
         library_manager = LibraryManager(config)
-        db_manager = DatabaseManager(config.data_dir)
+        db_manager = DatabaseManager(config.data_dir,
+                                     config.db_cache_mib,
+                                     config.db_mmap_mib)
         
         # Initialize database with library data
         if not await initialize_database(config, content_manager, db_manager):
@@ -294,19 +313,38 @@ async def main():
         await web_server.start()
         log.info("web_server.started")
         
-        # Setup signal handlers
-        loop = asyncio.get_running_loop()
-        for sig in (signal.SIGTERM, signal.SIGINT):
-            loop.add_signal_handler(sig, lambda s=sig: asyncio.create_task(shutdown(s)))
-        
         # Start monitoring server
         setup_monitoring()
         
+        await run_service(config, library_manager, content_manager,
+                          web_server, db_manager)
+        
+    except Exception as e:
+        log.error("startup.failed", error=str(e))
+        sys.exit(1)
+
+async def run_service(config: Config, library_manager: LibraryManager,
+                      content_manager: ContentManager, web_server: WebServer,
+                      db_manager: DatabaseManager):
+    """Run the update loop until a signal arrives, then shut down in order."""
+    # Signals only stop this task; every other task is stopped by shutdown()
+    # once the loop below has exited
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_shutdown, sig, main_task)
+    
+    try:
         while True:
             try:
                 # Only update library catalog
                 await library_manager.update_library()
                 
+                # Meta4 info unverified for a month is queued and refetched
+                # in the background; the old info serves until then
+                if await asyncio.to_thread(db_manager.cleanup_old_entries, days=30):
+                    asyncio.create_task(web_server._update_meta4_files())
+                
                 # Wait for next update
                 await asyncio.sleep(config.options.update_interval)
                 
@@ -315,20 +353,28 @@ async def main():
             except Exception as e:
                 log.error("update.failed", error=str(e))
                 await asyncio.sleep(60)  # Wait before retry
-        
-    except Exception as e:
-        log.error("startup.failed", error=str(e))
-        sys.exit(1)
+    finally:
+        await shutdown(content_manager, [db_manager, web_server.db])
 
-async def shutdown(sig):
+def request_shutdown(sig, main_task: asyncio.Task):
+    """Stop the main task; repeated signals during shutdown are ignored."""
+    log.info("shutdown.signal_received", signal=sig)
+    if not main_task.cancelling():
+        main_task.cancel()
+
+async def shutdown(content_manager: ContentManager, db_managers: List[DatabaseManager]):
     """Cleanup and shutdown."""
-    log.info("shutdown.starting", signal=sig)
+    log.info("shutdown.starting")
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
     [task.cancel() for task in tasks]
     log.info("shutdown.cancel_tasks", count=len(tasks))
     await asyncio.gather(*tasks, return_exceptions=True)
-    loop = asyncio.get_running_loop()
-    loop.stop()
+    # Downloads have stopped writing; keep their temp files for resuming
+    await content_manager.cleanup()
+    # Last, once nothing can write; closing also runs PRAGMA optimize
+    for db_manager in db_managers:
+        await asyncio.to_thread(db_manager.close)
+    log.info("shutdown.complete")
 
 if __name__ == "__main__":
     try:
@@ -4,7 +4,6 @@ Provides a web interface to manage content downloads.
 """
 
 import os
-import json
 import aiohttp
 import aiofiles
 from aiohttp import web
@@ -13,12 +12,15 @@ import xml.etree.ElementTree as ET
 from typing import Dict, List, Optional, Set
 from datetime import datetime
 import asyncio
-import sqlite3
 
+from content_manager import META4_FETCH_CONCURRENCY, PIPELINE_QUEUE_SIZE
 from database import DatabaseManager
 
 log = structlog.get_logger()
 
+# Meta4 results committed to the database per transaction
+META4_WRITE_BATCH = 50
+
 class WebServer:
     """Web server for managing content downloads."""
     
@@ -31,8 +33,11 @@ class WebServer:
         self.library_cache = None
         self.library_cache_time = None
         self.cache_ttl = 3600  # 1 hour cache TTL
-        self.db = DatabaseManager(config.data_dir)
-        self.meta4_semaphore = asyncio.Semaphore(100)  # Increased to 100 concurrent downloads
+        self.db = DatabaseManager(config.data_dir,
+                                  config.db_cache_mib,
+                                  config.db_mmap_mib)
+        # Never more fetches in flight than the shared session's per-host limit
+        self.meta4_semaphore = asyncio.Semaphore(META4_FETCH_CONCURRENCY)
         self.is_updating_meta4 = False
         self.successful_meta4_downloads = 0
         
@@ -64,96 +69,96 @@ class WebServer:
             
         try:
             async with self.meta4_semaphore:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as response:
-                        if response.status != 200:
-                            log.error("meta4_download.failed", url=url, status=response.status)
-                            return {}
+                session = await self.content_manager.get_session()
+                async with session.get(url) as response:
+                    if response.status != 200:
+                        log.error("meta4_download.failed", url=url, status=response.status)
+                        return {}
                         
-                        content = await response.text()
-                        root = ET.fromstring(content)
+                    content = await response.text()
+                    root = ET.fromstring(content)
                         
-                        # Extract file information
-                        file_elem = root.find(".//{urn:ietf:params:xml:ns:metalink}file")
-                        if file_elem is None:
-                            log.error("meta4_parse.no_file_element", url=url)
-                            return {}
+                    # Extract file information
+                    file_elem = root.find(".//{urn:ietf:params:xml:ns:metalink}file")
+                    if file_elem is None:
+                        log.error("meta4_parse.no_file_element", url=url)
+                        return {}
                         
-                        # Get file name
-                        file_name = file_elem.get("name", "")
+                    # Get file name
+                    file_name = file_elem.get("name", "")
                         
-                        # Get file size
-                        size_elem = file_elem.find(".//{urn:ietf:params:xml:ns:metalink}size")
-                        file_size = int(size_elem.text) if size_elem is not None and size_elem.text else 0
+                    # Get file size
+                    size_elem = file_elem.find(".//{urn:ietf:params:xml:ns:metalink}size")
+                    file_size = int(size_elem.text) if size_elem is not None and size_elem.text else 0
                         
-                        # Get hashes
-                        hashes = {}
-                        for hash_elem in file_elem.findall(".//{urn:ietf:params:xml:ns:metalink}hash"):
-                            hash_type = hash_elem.get("type", "")
-                            if hash_type and hash_elem.text:
-                                hashes[hash_type] = hash_elem.text
+                    # Get hashes
+                    hashes = {}
+                    for hash_elem in file_elem.findall(".//{urn:ietf:params:xml:ns:metalink}hash"):
+                        hash_type = hash_elem.get("type", "")
+                        if hash_type and hash_elem.text:
+                            hashes[hash_type] = hash_elem.text
                         
-                        # Get mirrors
-                        mirrors = []
-                        for url_elem in root.findall(".//{urn:ietf:params:xml:ns:metalink}url"):
-                            if url_elem.text:
-                                mirrors.append(url_elem.text)
+                    # Get mirrors
+                    mirrors = []
+                    for url_elem in root.findall(".//{urn:ietf:params:xml:ns:metalink}url"):
+                        if url_elem.text:
+                            mirrors.append(url_elem.text)
                         
-                        # Get additional metadata from parent XML
-                        parent_book = root.find(".//book")
-                        metadata = {
-                            "media_count": "0", "article_count": "0",
-                            "favicon": "", "favicon_mime_type": "",
-                            "title": "", "description": "",
-                            "language": "", "creator": "",
-                            "publisher": "", "name": "",
-                            "tags": "", "date": "",
-                            "size": "0"
-                        }
+                    # Get additional metadata from parent XML
+                    parent_book = root.find(".//book")
+                    metadata = {
+                        "media_count": "0", "article_count": "0",
+                        "favicon": "", "favicon_mime_type": "",
+                        "title": "", "description": "",
+                        "language": "", "creator": "",
+                        "publisher": "", "name": "",
+                        "tags": "", "date": "",
+                        "size": "0"
+                    }
                         
-                        if parent_book is not None:
-                            # Extract all available metadata
-                            # Get attributes first
-                            metadata.update({
-                                "media_count": parent_book.get("mediaCount", "0"),
-                                "article_count": parent_book.get("articleCount", "0"),
-                                "favicon": parent_book.get("favicon", ""),
-                                "favicon_mime_type": parent_book.get("faviconMimeType", ""),
-                                "size": parent_book.get("size", "0")
-                            })
+                    if parent_book is not None:
+                        # Extract all available metadata
+                        # Get attributes first
+                        metadata.update({
+                            "media_count": parent_book.get("mediaCount", "0"),
+                            "article_count": parent_book.get("articleCount", "0"),
+                            "favicon": parent_book.get("favicon", ""),
+                            "favicon_mime_type": parent_book.get("faviconMimeType", ""),
+                            "size": parent_book.get("size", "0")
+                        })
                             
-                            # Then get child elements
-                            for elem in parent_book:
-                                tag = elem.tag.split('}')[-1].lower()  # Handle namespaced tags
-                                if elem.text:
-                                    metadata[tag] = elem.text.strip()
+                        # Then get child elements
+                        for elem in parent_book:
+                            tag = elem.tag.split('}')[-1].lower()  # Handle namespaced tags
+                            if elem.text:
+                                metadata[tag] = elem.text.strip()
                         
-                        self.successful_meta4_downloads += 1
-                        if self.successful_meta4_downloads % 25 == 0:
-                            log.info("meta4_download.status", 
-                                   successful_downloads=self.successful_meta4_downloads)
+                    self.successful_meta4_downloads += 1
+                    if self.successful_meta4_downloads % 25 == 0:
+                        log.info("meta4_download.status", 
+                               successful_downloads=self.successful_meta4_downloads)
                         
-                        return {
-                            "file_name": file_name,
-                            "file_size": file_size,
-                            "md5_hash": hashes.get("md5", ""),
-                            "sha1_hash": hashes.get("sha-1", ""),
-                            "sha256_hash": hashes.get("sha-256", ""),
-                            "mirrors": mirrors,
-                            "meta4_url": url,
-                            "media_count": int(metadata.get("media_count", 0)),
-                            "article_count": int(metadata.get("article_count", 0)),
-                            "favicon": metadata.get("favicon", ""),
-                            "favicon_mime_type": metadata.get("favicon_mime_type", ""),
-                            "title": metadata.get("title", ""),
-                            "description": metadata.get("description", ""),
-                            "language": metadata.get("language", ""),
-                            "creator": metadata.get("creator", ""),
-                            "publisher": metadata.get("publisher", ""),
-                            "name": metadata.get("name", ""),
-                            "tags": metadata.get("tags", ""),
-                            "book_date": metadata.get("date", "")
-                        }
+                    return {
+                        "file_name": file_name,
+                        "file_size": file_size,
+                        "md5_hash": hashes.get("md5", ""),
+                        "sha1_hash": hashes.get("sha-1", ""),
+                        "sha256_hash": hashes.get("sha-256", ""),
+                        "mirrors": mirrors,
+                        "meta4_url": url,
+                        "media_count": int(metadata.get("media_count", 0)),
+                        "article_count": int(metadata.get("article_count", 0)),
+                        "favicon": metadata.get("favicon", ""),
+                        "favicon_mime_type": metadata.get("favicon_mime_type", ""),
+                        "title": metadata.get("title", ""),
+                        "description": metadata.get("description", ""),
+                        "language": metadata.get("language", ""),
+                        "creator": metadata.get("creator", ""),
+                        "publisher": metadata.get("publisher", ""),
+                        "name": metadata.get("name", ""),
+                        "tags": metadata.get("tags", ""),
+                        "book_date": metadata.get("date", "")
+                    }
                         
         except ET.ParseError as e:
             log.error("meta4_parse.xml_error", url=url, error=str(e))
@@ -171,45 +176,61 @@ class WebServer:
         self.successful_meta4_downloads = 0
         try:
             # Get books that need meta4 updates from database
-            books = self.db.get_books_needing_meta4_update()
+            books = await asyncio.to_thread(self.db.get_books_needing_meta4_update)
             if not books:
                 log.info("meta4_update.no_updates_needed")
                 return
             
             total_files = len(books)
             processed_files = 0
-            self.db.update_processing_status('meta4_update', total_files, processed_files)
+            await asyncio.to_thread(self.db.update_processing_status,
+                                    'meta4_update', total_files, processed_files)
+            
+            # Fetchers hand results to a single writer that commits them in
+            # groups, so database writes overlap with outstanding fetches
+            results: asyncio.Queue = asyncio.Queue(maxsize=META4_WRITE_BATCH * 4)
+            
+            # A fixed pool of fetchers pulls from a bounded queue rather than
+            # parking a task per book on the semaphore
+            pending: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
             
-            # Process meta4 files in larger batches
-            batch_size = 100
-            for i in range(0, len(books), batch_size):
-                batch = books[i:i+batch_size]
-                tasks = []
-                
-                for book in batch:
-                    task = asyncio.create_task(self._parse_meta4_file(book['url']))
-                    tasks.append((book['id'], task))
-                
-                # Wait for batch to complete
+            async def enqueue_books():
+                for book in books:
+                    await pending.put(book)
+                for _ in range(META4_FETCH_CONCURRENCY):
+                    await pending.put(None)
+            
+            async def fetch_and_enqueue():
+                while (book := await pending.get()) is not None:
+                    meta4_data = await self._parse_meta4_file(book['url'])
+                    if meta4_data:
+                        meta4_data['book_id'] = book['id']
+                        meta4_data['book_date'] = book['date']
+                    await results.put(meta4_data)
+            
+            async def write_results():
+                nonlocal processed_files
                 updates = []
-                for book_id, task in tasks:
-                    try:
-                        meta4_data = await task
-                        if meta4_data:
-                            meta4_data['book_id'] = book_id
-                            meta4_data['book_date'] = book['date']
-                            updates.append(meta4_data)
-                    except Exception as e:
-                        log.error("meta4_batch.failed", book_id=book_id, error=str(e))
-                
-                # Batch update database
-                if updates:
-                    await self.db.batch_update_meta4_info(updates)
-                
-                processed_files += len(batch)
-                self.db.update_processing_status('meta4_update', total_files, processed_files)
+                while processed_files < total_files:
+                    meta4_data = await results.get()
+                    processed_files += 1
+                    if meta4_data:
+                        updates.append(meta4_data)
+                    
+                    if processed_files % META4_WRITE_BATCH == 0 or processed_files == total_files:
+                        await self.db.batch_update_meta4_info(updates)
+                        updates = []
+                        await asyncio.to_thread(self.db.update_processing_status,
+                                                'meta4_update', total_files, processed_files)
+            
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(write_results())
+                tg.create_task(enqueue_books())
+                for _ in range(META4_FETCH_CONCURRENCY):
+                    tg.create_task(fetch_and_enqueue())
             
-            self.db.update_processing_status('meta4_update', total_files, processed_files, True)
+            await asyncio.to_thread(self.db.update_processing_status,
+                                    'meta4_update', total_files, processed_files, True)
             log.info("meta4_update.complete", 
                     total=total_files, 
                     successful=self.successful_meta4_downloads,
@@ -217,7 +238,8 @@ class WebServer:
             
         except Exception as e:
             log.error("meta4_update.failed", error=str(e))
-            self.db.update_processing_status('meta4_update', 0, 0, True, error_count=1)
+            await asyncio.to_thread(self.db.update_processing_status,
+                                    'meta4_update', 0, 0, True, error_count=1)
         finally:
             self.is_updating_meta4 = False
     
@@ -231,53 +253,8 @@ class WebServer:
                 return self.library_cache
         
         try:
-            # Get all books from database
-            books = []
-            with sqlite3.connect(self.db.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Get books with their meta4 info
-                cursor.execute("""
-                SELECT b.*, m.file_size, m.md5_hash, m.sha1_hash, m.sha256_hash,
-                       m.piece_length, m.last_meta4_update, m.meta4_url, m.id as meta4_id
-                FROM books b
-                LEFT JOIN meta4_info m ON b.id = m.book_id
-                """)
-                
-                columns = [desc[0] for desc in cursor.description]
-                
-                for row in cursor.fetchall():
-                    try:
-                        book_data = dict(zip(columns, row))
-                        meta4_id = book_data.pop('meta4_id', None)
-                        
-                        # Get mirror URLs if meta4 info exists
-                        if meta4_id:
-                            cursor.execute("""
-                            SELECT url FROM mirror_urls
-                            WHERE meta4_id = ?
-                            ORDER BY priority
-                            """, (meta4_id,))
-                            book_data['mirrors'] = [row[0] for row in cursor.fetchall()]
-                        else:
-                            book_data['mirrors'] = []
-                        
-                        # Parse JSON fields
-                        if book_data.get('tags'):
-                            book_data['tags'] = json.loads(book_data['tags'])
-                        
-                        # Map database fields to web interface fields
-                        book_data['mediaCount'] = book_data.pop('media_count', 0)
-                        book_data['articleCount'] = book_data.pop('article_count', 0)
-                        book_data['downloaded'] = book_data.get('download_status') == 'downloaded'
-                        
-                        books.append(book_data)
-                        
-                    except Exception as e:
-                        log.error("library_parse.book_failed", 
-                                book_id=row[0] if row else 'unknown',
-                                error=str(e))
-                        continue
+            # The database read runs on a worker thread, off the event loop
+            books = await asyncio.to_thread(self._load_library_books)
             
             # Update cache
             self.library_cache = books
@@ -289,6 +266,16 @@ class WebServer:
             log.error("library_fetch.failed", error=str(e))
             return None
     
+    def _load_library_books(self) -> List[Dict]:
+        """Read every book and map it to the web interface fields."""
+        books = self.db.load_library_books()
+        for book_data in books:
+            # Map database fields to web interface fields
+            book_data['mediaCount'] = book_data.pop('media_count', 0)
+            book_data['articleCount'] = book_data.pop('article_count', 0)
+            book_data['downloaded'] = book_data.get('download_status') == 'downloaded'
+        return books
+    
     async def handle_index(self, request):
         """Handle the index page request."""
         try:
@@ -314,7 +301,7 @@ class WebServer:
     async def handle_meta4_status(self, request):
         """Handle meta4 download status request."""
         try:
-            status = self.db.get_processing_status('meta4_update')
+            status = await asyncio.to_thread(self.db.get_processing_status, 'meta4_update')
             return web.json_response(status)
         except Exception as e:
             log.error("meta4_status.failed", error=str(e))